@@ -16,17 +16,23 @@ import logging.config
 import logging.handlers
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Set
 
 import google.api_core.exceptions
+import google.auth
 import sqlalchemy
+from google.api_core import retry as retries
 from google.api_core.client_info import ClientInfo as bg_ClientInfo
 from google.api_core.gapic_v1.client_info import ClientInfo
 from google.cloud import bigquery
 from google.cloud import discoveryengine_v1 as discoveryengine
 from google.cloud import storage
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud.alloydb.connector import Connector, IPTypes
+from requests.adapters import HTTPAdapter
 from sqlalchemy.engine import Engine
 
 logging_config = {
@@ -85,6 +91,34 @@ def init_connection_pool(connector: Connector) -> Engine:
 
 USER_AGENT = "cloud-solutions/eks-docai-v1"
 
+# Documents deleted together, with one set based delete per table
+DELETE_BATCH_SIZE = 1000
+
+# GCS objects deleted concurrently
+DELETE_WORKERS = 32
+
+# Agent Builder documents deleted concurrently (unless set in the environment
+# as AGENT_BUILDER_DELETE_WORKERS)
+AGENT_BUILDER_DELETE_WORKERS = 8
+
+# DeleteDocument has no default retry, so calls throttled by the quota
+# (or hitting an unavailable service) are retried with backoff
+AGENT_BUILDER_DELETE_RETRY = retries.Retry(
+    predicate=retries.if_exception_type(
+        google.api_core.exceptions.ResourceExhausted,
+        google.api_core.exceptions.ServiceUnavailable,
+    ),
+    initial=1,
+    maximum=30,
+    timeout=300,
+)
+
+# Documents purged from Agent Builder per long running operation (batch mode)
+PURGE_BATCH_SIZE = 100000
+
+# Seconds between checks of the progress of a purge
+PURGE_POLL_SECONDS = 10
+
 
 @dataclass
 class DocProcessingRecord:
@@ -134,50 +168,131 @@ def get_docs_data_from_bq(
     ]
 
 
-def delete_doc_from_agent_build(
-    document_service_client: discoveryengine.DocumentServiceClient,
-    data_store_config: DataStoreConfig,
-    obj_id: str,
-):
-    full_doc_id = (
+def get_data_store_branch(data_store_config: DataStoreConfig) -> str:
+    return (
         f"projects/{data_store_config.project_id}"
         f"/locations/{data_store_config.region}"
         f"/collections/{data_store_config.collection}"
         f"/dataStores/{data_store_config.id}"
         f"/branches/{data_store_config.branch}"
-        f"/documents/{obj_id}"
     )
 
+
+def delete_doc_from_agent_build(
+    document_service_client: discoveryengine.DocumentServiceClient,
+    data_store_config: DataStoreConfig,
+    obj_id: str,
+):
+    full_doc_id = f"{get_data_store_branch(data_store_config)}/documents/{obj_id}"
+
     logger.info(f"Deleting document {full_doc_id}")
 
     request = discoveryengine.DeleteDocumentRequest(name=full_doc_id)
     try:
         document_service_client.delete_document(
-            request=request
+            request=request, retry=AGENT_BUILDER_DELETE_RETRY
         )  # pyright: ignore [reportArgumentType]
     except google.api_core.exceptions.NotFound:
         logger.warning(f"Document {full_doc_id} was already deleted.")
 
 
-def delete_doc_from_bq_processed_documents(bq_client: bigquery.Client, doc_id: str):
-    sql = f"DELETE FROM docs_store.prcessed_documents WHERE id='{doc_id}'"
-    logger.info(f"Deleting document {doc_id} from processed documents table")
-    res = bq_client.query(sql)
+def purge_docs_from_agent_build(
+    document_service_client: discoveryengine.DocumentServiceClient,
+    storage_client: storage.Client,
+    data_store_config: DataStoreConfig,
+    run_id: str,
+    doc_ids: List[str],
+) -> List[str]:
+    """Purge documents from the data store with long running operations
+
+    The ids of each operation are written to a file in the run folder, the
+    source of the purge. Return the ids of the operations that failed or
+    did not purge every document, to be deleted one by one."""
+    bucket = storage_client.bucket(f"dpu-process-{storage_client.project}")
+    unpurged = []
+    for i in range(0, len(doc_ids), PURGE_BATCH_SIZE):
+        batch = doc_ids[i : i + PURGE_BATCH_SIZE]
+        blob = bucket.blob(
+            f"{get_run_folder(run_id)}doc-deletion/purge-{i // PURGE_BATCH_SIZE:05d}.txt"
+        )
+        blob.upload_from_string("\n".join(batch), content_type="text/plain")
+        request = discoveryengine.PurgeDocumentsRequest(
+            parent=get_data_store_branch(data_store_config),
+            filter="*",
+            gcs_source=discoveryengine.GcsSource(
+                input_uris=[f"gs://{bucket.name}/{blob.name}"],
+                data_schema="document_id",
+            ),
+            force=True,
+        )
+        logger.info(f"Purging {len(batch)} documents from the data store")
+        try:
+            operation = document_service_client.purge_documents(request=request)
+            while not operation.done():
+                metadata = operation.metadata
+                if metadata is not None:
+                    logger.info(
+                        f"Purged {metadata.success_count} of {len(batch)} documents "
+                        f"({metadata.failure_count} failed)"
+                    )
+                time.sleep(PURGE_POLL_SECONDS)
+            response = operation.result()
+            metadata = operation.metadata
+            if metadata is not None:
+                logger.info(
+                    f"Purged {response.purge_count} of {len(batch)} documents "
+                    f"({metadata.failure_count} failed, "
+                    f"{metadata.ignored_count} ignored)"
+                )
+                if metadata.failure_count:
+                    unpurged.extend(batch)
+            elif response.purge_count < len(batch):
+                # Without the counts, ignored documents cannot be told apart
+                # from failed ones
+                logger.info(
+                    f"Purged {response.purge_count} of {len(batch)} documents "
+                    f"(no counts of failed documents)"
+                )
+                unpurged.extend(batch)
+        except google.api_core.exceptions.GoogleAPICallError as e:
+            logger.warning(f"Purge of {len(batch)} documents failed: {e}")
+            unpurged.extend(batch)
+        finally:
+            try:
+                blob.delete()
+            except google.api_core.exceptions.GoogleAPIError as e:
+                logger.warning(f"Failed to delete purge source {blob.name}: {e}")
+    return unpurged
+
+
+def delete_docs_from_bq_table(
+    bq_client: bigquery.Client, table: str, doc_ids: List[str]
+):
+    sql = f"DELETE FROM `{table}` WHERE id IN UNNEST(@doc_ids)"
+    logger.info(f"Deleting {len(doc_ids)} documents from {table} table")
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("doc_ids", "STRING", doc_ids)]
+    )
+    res = bq_client.query(sql, job_config=job_config)
+    res.result()
     if res.errors:
         raise Exception(res.errors[0]["message"])
 
 
-def delete_doc_from_alloydb_processed_documents(doc_id: str):
-    # Delete data from AlloyDB
-    logger.info(f"Deleting document {doc_id} from AlloyDB")
-    with Connector(refresh_strategy="lazy") as connector:
-        pool: Engine = init_connection_pool(connector)
-        with pool.connect() as db_conn:
-            db_conn.execute(
-                sqlalchemy.text(
-                    f"DELETE FROM eks.processed_documents WHERE id='{doc_id}'"
-                )
-            )
+def delete_docs_from_bq_processed_documents(
+    bq_client: bigquery.Client, doc_ids: List[str]
+):
+    delete_docs_from_bq_table(bq_client, "docs_store.prcessed_documents", doc_ids)
+
+
+def delete_docs_from_alloydb_processed_documents(pool: Engine, doc_ids: List[str]):
+    # Delete data from AlloyDB, in one transaction over a pooled connection
+    logger.info(f"Deleting {len(doc_ids)} documents from AlloyDB")
+    with pool.begin() as db_conn:
+        db_conn.execute(
+            sqlalchemy.text("DELETE FROM eks.processed_documents WHERE id = ANY(:ids)"),
+            {"ids": doc_ids},
+        )
 
 
 def delete_doc_from_gcs(storage_client: storage.Client, gcs_uri: str):
@@ -194,22 +309,63 @@ def delete_doc_from_gcs(storage_client: storage.Client, gcs_uri: str):
         logger.warning(f"GCS Object {gcs_path} was already deleted.")
 
 
-def delete_doc_from_metadata_table(
-    bq_client: bigquery.Client, data_table: str, doc_id: str
+def delete_docs_from_metadata_table(
+    bq_client: bigquery.Client, data_table: str, doc_ids: List[str]
 ):
-    sql = f"DELETE FROM `{data_table}` WHERE id='{doc_id}'"
-    logger.info(f"Deleting document {doc_id} from {data_table} table")
-    res = bq_client.query(sql)
-    if res.errors:
-        raise Exception(res.errors[0]["message"])
+    delete_docs_from_bq_table(bq_client, data_table, doc_ids)
 
 
-def delete_doc_from_doc_registry(bq_client: bigquery.Client, doc_id: str):
-    sql = f"DELETE FROM `docs_registry.docs_registry` WHERE id='{doc_id}'"
-    logger.info(f"Deleting document {doc_id} from document registry table")
-    res = bq_client.query(sql)
-    if res.errors:
-        raise Exception(res.errors[0]["message"])
+def delete_docs_from_doc_registry(bq_client: bigquery.Client, doc_ids: List[str]):
+    delete_docs_from_bq_table(bq_client, "docs_registry.docs_registry", doc_ids)
+
+
+def delete_docs(
+    executor: ThreadPoolExecutor,
+    agent_builder_executor: ThreadPoolExecutor,
+    pool: Engine,
+    storage_client: storage.Client,
+    bq_client: bigquery.Client,
+    document_service_client: discoveryengine.DocumentServiceClient,
+    data_store_config: DataStoreConfig,
+    data_table: str,
+    docs: List[DocProcessingRecord],
+    purged: Optional[Set[str]] = None,
+):
+    """Delete a batch of documents everywhere they are stored
+
+    The Agent Builder documents (not already purged) and GCS objects are
+    deleted concurrently (on separate pools, as Agent Builder has a lower
+    quota), alongside one delete per BigQuery table for the
+    whole batch. The documents are deleted from the run table last, once
+    everything else succeeded, so that a failed deletion can be retried."""
+    doc_ids = [doc.id for doc in docs]
+    futures = [
+        agent_builder_executor.submit(
+            delete_doc_from_agent_build,
+            document_service_client,
+            data_store_config,
+            doc_id,
+        )
+        for doc_id in doc_ids
+        if purged is None or doc_id not in purged
+    ]
+    futures.extend(
+        executor.submit(delete_doc_from_gcs, storage_client, gcs_uri)
+        for doc in docs
+        for gcs_uri in doc.gcs_uris + doc.results_files
+    )
+    futures.append(
+        executor.submit(delete_docs_from_bq_processed_documents, bq_client, doc_ids)
+    )
+    futures.append(executor.submit(delete_docs_from_doc_registry, bq_client, doc_ids))
+    futures.append(
+        executor.submit(delete_docs_from_alloydb_processed_documents, pool, doc_ids)
+    )
+
+    for future in futures:
+        future.result()
+
+    delete_docs_from_metadata_table(bq_client, data_table, doc_ids)
 
 
 def drop_data_table(bq_client: bigquery.Client, data_table: str):
@@ -230,28 +386,45 @@ def drop_data_table(bq_client: bigquery.Client, data_table: str):
         raise Exception(res.errors[0]["message"])
 
 
+def get_run_folder(run_id: str) -> str:
+    return f"docs-processing-{run_id.replace('_', '-')}/"
+
+
 def delete_gcs_folder(storage_client: storage.Client, run_id: str):
     bucket = storage_client.bucket(
         f"dpu-process-{storage_client.project}"
     )  # type: storage.Bucket
-    blobs = [
-        b
-        for b in bucket.list_blobs(
-            prefix=f"docs-processing-{run_id.replace('_', '-')}/"
-        )
-    ]
+    blobs = [b for b in bucket.list_blobs(prefix=get_run_folder(run_id))]
     for blob in blobs:
         logger.warning(f"blob {blob.name} was detected as leftover - will be deleted")
     bucket.delete_blobs(blobs=blobs)
 
 
+def get_storage_client() -> storage.Client:
+    """Storage client with its HTTP connection pool sized for the concurrent
+    deletes (the default pool keeps 10 connections)"""
+    credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    session.mount(
+        "https://",
+        HTTPAdapter(pool_connections=DELETE_WORKERS, pool_maxsize=DELETE_WORKERS),
+    )
+    return storage.Client(
+        project=project,
+        credentials=credentials,
+        _http=session,
+        client_info=ClientInfo(user_agent=USER_AGENT),
+    )
+
+
 def main(
     data_store_config: DataStoreConfig,
     run_id: str,
     mode: str,
     doc_id: Optional[str] = None,
+    agent_builder_workers: int = AGENT_BUILDER_DELETE_WORKERS,
 ):
-    storage_client = storage.Client(client_info=ClientInfo(user_agent=USER_AGENT))
+    storage_client = get_storage_client()
     bq_client = bigquery.Client(client_info=bg_ClientInfo(user_agent=USER_AGENT))
 
     client_options = (
@@ -265,19 +438,55 @@ def main(
     data_table = f"docs_store.docs_processing_{run_id.replace('-', '_')}"
     docs = get_docs_data_from_bq(bq_client, data_table, doc_id)
     logger.info(f"Deleting {len(docs)} documents")
-    for doc in docs:
-        logger.info(f"Deleting document {doc.id} with URIs: {doc.gcs_uris}")
-        delete_doc_from_agent_build(
-            document_service_client,
-            data_store_config,
-            doc.id,
+    stats: Dict[str, Any] = {"documents": len(docs), "purged": 0}
+    start = time.perf_counter()
+
+    # A whole run is purged from the data store in bulk, and only the
+    # documents that could not be purged are deleted one by one
+    purged: Optional[Set[str]] = None
+    if mode == "batch" and docs:
+        doc_ids = [doc.id for doc in docs]
+        unpurged = set(
+            purge_docs_from_agent_build(
+                document_service_client,
+                storage_client,
+                data_store_config,
+                run_id,
+                doc_ids,
+            )
         )
-        delete_doc_from_bq_processed_documents(bq_client, doc.id)
-        delete_doc_from_alloydb_processed_documents(doc.id)
-        for gcs_uri in doc.gcs_uris + doc.results_files:
-            delete_doc_from_gcs(storage_client, gcs_uri)
-        delete_doc_from_metadata_table(bq_client, data_table, doc.id)
-        delete_doc_from_doc_registry(bq_client, doc.id)
+        purged = {doc_id for doc_id in doc_ids if doc_id not in unpurged}
+        stats["purged"] = len(purged)
+        stats["purge_seconds"] = round(time.perf_counter() - start, 1)
+
+    # One connection pool to AlloyDB for the whole job
+    with (
+        Connector(refresh_strategy="lazy") as connector,
+        ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor,
+        ThreadPoolExecutor(max_workers=agent_builder_workers) as agent_builder_executor,
+    ):
+        pool = init_connection_pool(connector)
+        for i in range(0, len(docs), DELETE_BATCH_SIZE):
+            batch = docs[i : i + DELETE_BATCH_SIZE]
+            for doc in batch:
+                logger.info(f"Deleting document {doc.id} with URIs: {doc.gcs_uris}")
+            delete_docs(
+                executor,
+                agent_builder_executor,
+                pool,
+                storage_client,
+                bq_client,
+                document_service_client,
+                data_store_config,
+                data_table,
+                batch,
+                purged,
+            )
+            logger.info(f"Deleted {i + len(batch)} of {len(docs)} documents")
+        pool.dispose()
+    stats["deleted_individually"] = stats["documents"] - stats["purged"]
+    stats["seconds"] = round(time.perf_counter() - start, 1)
+    logger.info(f"Deletion stats: {stats}")
     if mode == "batch":
         delete_gcs_folder(storage_client, run_id)
         drop_data_table(bq_client, data_table)
@@ -299,4 +508,8 @@ if __name__ == "__main__":
         _mode == "single" and _doc_id
     ), "Mode and doc_id mismatch"
 
-    main(_data_store_config, _run_id, _mode, _doc_id)
+    _agent_builder_workers = int(
+        os.environ.get("AGENT_BUILDER_DELETE_WORKERS", AGENT_BUILDER_DELETE_WORKERS)
+    )
+
+    main(_data_store_config, _run_id, _mode, _doc_id, _agent_builder_workers)
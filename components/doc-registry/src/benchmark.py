@@ -0,0 +1,257 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks for the document registry service"""
+
+import argparse
+import gc
+import io
+import json
+import random
+import time
+import tracemalloc
+
+from document_registry_service import (
+    DETECT_BATCH_SIZE,
+    ChecksumBatch,
+    Duplicate,
+    GoogleCloudClients,
+    look_up_document,
+)
+
+
+class DictRegistryDocument:
+    """Previous document (one object per listed object, with the attributes
+    in a per instance dict), kept as the baseline"""
+
+    def __init__(self, id: str, bucket: str, folder: str, name: str, crc32: int):
+        self.id = id
+        self.bucket = bucket
+        self.folder = folder
+        self.name = name
+        self.crc32 = crc32
+
+
+def look_up_document_union_all(registry_table: str, crc32s: list[str]):
+    """Previous look up (one UNION ALL row per checksum in the query text),
+    kept as the baseline"""
+    unique_crc32s = list(set(crc32s))
+    select_crc32_rows = [f"SELECT '{crc32}' AS crc32" for crc32 in unique_crc32s]
+    crc32_table = " UNION ALL ".join(select_crc32_rows)
+    crc32_table_alias = "crc32_table"
+    query = " ".join(
+        [
+            f"WITH {crc32_table_alias} AS ({crc32_table})",
+            f"SELECT id, fileName, gcsUri, a.crc32 FROM `{registry_table}` AS a",
+            f"INNER JOIN {crc32_table_alias} AS b",
+            "ON a.crc32 = b.crc32",
+        ]
+    )
+    return list(GoogleCloudClients.get_bq_client().query(query))
+
+
+def benchmark_look_up(args):
+    """Registry look up time by number of checksums"""
+    print(f"{'checksums':>10} {'union all s':>12} {'unnest s':>9} {'matches':>8}")
+    for count in args.counts:
+        crc32s = [str(random.getrandbits(32)) for _ in range(count)]
+
+        before = "-"
+        if count <= args.max_union_all:
+            start = time.perf_counter()
+            try:
+                look_up_document_union_all(args.registry_table, crc32s)
+                before = f"{time.perf_counter() - start:.2f}"
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                before = "failed"
+                print(f"Union all look up of {count} checksums failed: {e}")
+
+        start = time.perf_counter()
+        matches = look_up_document(args.registry_table, crc32s)
+        after = time.perf_counter() - start
+
+        print(f"{count:>10} {before:>12} {after:>9.2f} {len(matches):>8}")
+
+
+def synthetic_listing(count: int, folders: int):
+    """Bucket, object name and checksum of the objects of a folder listing,
+    created as they are iterated (as from a listing)"""
+    for i in range(count):
+        yield (
+            "docs-input-bucket",
+            f"uploads/batch-{i % folders:04d}/document-{i:08d}.pdf",
+            random.getrandbits(32),
+        )
+
+
+def dict_documents(args):
+    docs = []
+    for bucket, blob_name, crc32 in synthetic_listing(args.count, args.folders):
+        parts = blob_name.split("/")
+        docs.append(
+            DictRegistryDocument("", bucket, "/".join(parts[:-1]), parts[-1], crc32)
+        )
+    return docs
+
+
+def checksum_batch(args):
+    batch = ChecksumBatch("docs-input-bucket")
+    for _, blob_name, crc32 in synthetic_listing(args.count, args.folders):
+        batch.append(crc32, blob_name)
+    return batch
+
+
+def benchmark_memory(args):
+    """Memory per document held for a folder, and time to build it"""
+    print(f"{args.count} objects in {args.folders} folders")
+    print(f"{'representation':>16} {'bytes/doc':>10} {'build us/doc':>13}")
+    for label, build in [
+        ("dict", dict_documents),
+        ("checksum batch", checksum_batch),
+    ]:
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        docs = build(args)
+        elapsed = time.perf_counter() - start
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            f"{label:>16} {size / args.count:>10.0f} "
+            f"{elapsed / args.count * 1e6:>13.2f}"
+        )
+        del docs
+
+
+def synthetic_duplicates(count: int) -> list[Duplicate]:
+    return [
+        Duplicate(
+            f"gs://docs-input-bucket/uploads/batch-{i % 100:04d}/document-{i:08d}.pdf",
+            f"gs://docs-input-bucket/archive/document-{i:08d}.pdf",
+            f"id-{random.getrandbits(64):016x}",
+        )
+        for i in range(count)
+    ]
+
+
+def write_json_dumps(duplicates: list[dict]) -> str:
+    """Previous encoding (json.dumps and a write per duplicate), kept as the
+    baseline"""
+    f = io.StringIO()
+    for i, dup in enumerate(duplicates):
+        if i > 0:
+            f.write("\n")
+        f.write(json.dumps(dup))
+    return f.getvalue()
+
+
+def write_batched(duplicates: list[Duplicate], batch_size: int) -> str:
+    f = io.StringIO()
+    separator = ""
+    for i in range(0, len(duplicates), batch_size):
+        f.write(separator)
+        f.write("\n".join(d.get_json_str() for d in duplicates[i : i + batch_size]))
+        separator = "\n"
+    return f.getvalue()
+
+
+def benchmark_encode(args):
+    """JSON lines encoding time of the duplicates found"""
+    duplicates = synthetic_duplicates(args.count)
+    dicts = [d.to_dict() for d in duplicates]
+    print(f"{args.count} duplicates, in batches of {args.batch_size}")
+    print(f"{'encoding':>16} {'us/dup':>8}")
+
+    outputs = []
+    for label, encode in [
+        ("json.dumps", lambda: write_json_dumps(dicts)),
+        ("batched", lambda: write_batched(duplicates, args.batch_size)),
+    ]:
+        start = time.perf_counter()
+        outputs.append(encode())
+        elapsed = time.perf_counter() - start
+        print(f"{label:>16} {elapsed / args.count * 1e6:>8.2f}")
+
+    if outputs[0] != outputs[1]:
+        raise RuntimeError("The encodings differ")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for the document registry service",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(required=True)
+
+    look_up = subparsers.add_parser(
+        "look_up",
+        help=benchmark_look_up.__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    look_up.add_argument(
+        "--registry_table",
+        type=str,
+        required=True,
+        help="Fully qualified document registry table",
+    )
+    look_up.add_argument(
+        "--counts",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000, 1000000],
+        help="Numbers of (random) checksums to look up",
+    )
+    look_up.add_argument(
+        "--max_union_all",
+        type=int,
+        default=100000,
+        help="Largest number of checksums to try with the previous look up",
+    )
+    look_up.set_defaults(func=benchmark_look_up)
+
+    memory = subparsers.add_parser(
+        "memory",
+        help=benchmark_memory.__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    memory.add_argument(
+        "--count", type=int, default=1000000, help="Objects in the folder"
+    )
+    memory.add_argument(
+        "--folders", type=int, default=100, help="Sub-folders of the objects"
+    )
+    memory.set_defaults(func=benchmark_memory)
+
+    encode = subparsers.add_parser(
+        "encode",
+        help=benchmark_encode.__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    encode.add_argument(
+        "--count", type=int, default=1000000, help="Duplicates to encode"
+    )
+    encode.add_argument(
+        "--batch_size",
+        type=int,
+        default=DETECT_BATCH_SIZE,
+        help="Documents per look up batch",
+    )
+    encode.set_defaults(func=benchmark_encode)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,15 +13,23 @@
 # limitations under the License.
 
 import base64
+import bisect
+import collections
+import functools
+import heapq
 import json
 import logging
 import logging.config
 import os
 import sys
-from typing import Optional, Sequence
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from json.encoder import encode_basestring_ascii
+from typing import Iterable, Optional, Sequence
 
 import proto
 from google.api_core.client_info import ClientInfo
+from google.api_core.exceptions import NotFound, PreconditionFailed
 from google.api_core.gapic_v1.client_info import ClientInfo as GapicClientInfo
 from google.cloud import bigquery_storage_v1  # type: ignore[import-untyped]
 from google.cloud import bigquery, storage
@@ -59,6 +67,33 @@ logging.config.dictConfig(logging_config)
 logging.basicConfig(level="INFO")
 logger = logging.getLogger(__name__)
 
+# Checksums per registry look up query, and queries run concurrently
+LOOK_UP_CHUNK_SIZE = 50000
+LOOK_UP_WORKERS = 8
+
+# Storage Write API requests are limited to 10MB, so appends are split in
+# requests of up to this size (serialized rows and their framing)
+APPEND_MAX_REQUEST_BYTES = 9 * 1024 * 1024
+APPEND_ROW_OVERHEAD = 8
+
+# Rows fetched per page of query results
+QUERY_PAGE_SIZE = 10000
+
+# Objects listed per object needed, before fetching them one by one
+LIST_MAX_FACTOR = 10
+
+# Object metadata requests per batch request
+GET_BATCH_SIZE = 100
+
+# Listed documents screened and looked up in the registry per batch
+DETECT_BATCH_SIZE = LOOK_UP_CHUNK_SIZE
+
+# Fields of the listed objects needed for a document
+LIST_FIELDS = "items(name,crc32c),nextPageToken"
+
+# Attempts to update the checksum snapshot when it is concurrently replaced
+SNAPSHOT_UPDATE_ATTEMPTS = 5
+
 
 class DocumentInfo(proto.Message):
     """DocumentInfo for a file ingested in EKS"""
@@ -99,25 +134,55 @@ class GoogleCloudClients:
         return cls.bq_write_client
 
 
-class RegistryDocument:
-    def __init__(self, id: str, bucket: str, folder: str, name: str, crc32: int):
-        self.id = id
-        self.bucket = bucket
-        self.folder = folder
-        self.name = name
-        self.crc32 = crc32
+class ChecksumBatch:
+    """Checksums and object names of a batch of listed documents
 
-    def get_json_str(self):
-        return json.dumps(self.__dict__)
+    These are kept as an array and a list of names, rather than as an object
+    per document, to keep the batch compact."""
+
+    __slots__ = ("bucket_name", "crc32s", "names")
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+        self.crc32s = array("I")
+        self.names: list[str] = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def append(self, crc32: int, name: str):
+        self.crc32s.append(crc32)
+        self.names.append(name)
+
+    def get_gcs_uri(self, i: int):
+        return r"gs://" + f"{self.bucket_name}/{self.names[i]}"
 
-    def __str__(self):
-        return self.get_json_str()
 
-    def get_gcs_name(self):
-        return self.name if self.folder == "" else f"{self.folder}/{self.name}"
+class Duplicate:
+    """Listed document found in the registry (slotted to keep it compact)"""
 
-    def get_gcs_uri(self):
-        return r"gs://" + f"{self.bucket}/{self.get_gcs_name()}"
+    __slots__ = ("doc", "existing_uri", "existing_id")
+
+    def __init__(self, doc: str, existing_uri: str, existing_id: str):
+        self.doc = doc
+        self.existing_uri = existing_uri
+        self.existing_id = existing_id
+
+    def to_dict(self):
+        return {
+            "doc": self.doc,
+            "existing_doc": {"uri": self.existing_uri, "id": self.existing_id},
+        }
+
+    def get_json_str(self):
+        """Same output as json.dumps of to_dict(), without building the dict"""
+        if self.existing_uri is None or self.existing_id is None:
+            return json.dumps(self.to_dict())
+        return (
+            f'{{"doc": {encode_basestring_ascii(self.doc)}, '
+            f'"existing_doc": {{"uri": {encode_basestring_ascii(self.existing_uri)}, '
+            f'"id": {encode_basestring_ascii(self.existing_id)}}}}}'
+        )
 
 
 class GCSFolder:
@@ -127,7 +192,6 @@ class GCSFolder:
             full_folder_path
         )
         self.bucket: Optional[storage.Bucket] = None
-        self.docs: Optional[list[RegistryDocument]] = None
 
     def get_bucket(self):
         if self.bucket is None:
@@ -136,12 +200,46 @@ class GCSFolder:
             )
         return self.bucket
 
-    def get_documents_in_folder(self):
-        if self.docs is None:
-            blobs = self.get_bucket().list_blobs(prefix=self.folder_prefix)
-            self.docs = [GCSFolder.blob_to_doc(blob) for blob in blobs]
-        for doc in self.docs:
-            yield doc
+    def list_blobs(self, max_results: Optional[int] = None):
+        """List the objects in the folder (and not in sibling folders
+        sharing its name as a prefix)"""
+        prefix = f"{self.folder_prefix.rstrip('/')}/" if self.folder_prefix else ""
+        return self.get_bucket().list_blobs(
+            prefix=prefix, fields=LIST_FIELDS, max_results=max_results
+        )
+
+    def get_checksums(self, names: Iterable[str]) -> dict[str, int]:
+        """Fetch the checksums of objects by name, in batched requests
+
+        Objects that do not exist are left out."""
+        client = GoogleCloudClients.get_storage_client()
+        names = list(names)
+        crc32s = {}
+        for i in range(0, len(names), GET_BATCH_SIZE):
+            blobs = [self.get_bucket().blob(n) for n in names[i : i + GET_BATCH_SIZE]]
+            with client.batch(raise_exception=False):
+                for blob in blobs:
+                    blob.reload()
+            for blob in blobs:
+                try:
+                    crc32c = blob.crc32c
+                except KeyError:
+                    # The request failed, the properties are still a future
+                    continue
+                if crc32c is not None:
+                    crc32s[blob.name] = GCSFolder.base64_to_int(crc32c)
+        return crc32s
+
+    def get_checksum_batches(self, batch_size: int):
+        """Stream the documents in the folder as batches of checksums"""
+        batch = ChecksumBatch(self.bucket_name)
+        for blob in self.list_blobs():
+            batch.append(GCSFolder.base64_to_int(blob.crc32c), blob.name)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = ChecksumBatch(self.bucket_name)
+        if len(batch) > 0:
+            yield batch
 
     def write_to_folder(self, content: str, file_name: str, mime_type: str):
         blob_name = (
@@ -153,26 +251,33 @@ class GCSFolder:
             content, content_type=mime_type
         )
 
-    @staticmethod
-    def blob_to_doc(blob: storage.Blob) -> RegistryDocument:
-        crc32_int = GCSFolder.base64_to_int(blob.crc32c)
-        bucket_name = blob.bucket.name
-        folder, doc_name = GCSFolder.extract_folder_doc_name(blob.name)
-        return RegistryDocument("", bucket_name, folder, doc_name, crc32_int)
+    def read_from_folder(self, file_name: str) -> Optional[str]:
+        """Read a text file in the folder, or None if it does not exist"""
+        blob_name = (
+            file_name
+            if self.folder_prefix == ""
+            else f"{self.folder_prefix}/{file_name}"
+        )
+        try:
+            return self.get_bucket().blob(blob_name).download_as_text()
+        except NotFound:
+            return None
+
+    def open_in_folder(self, file_name: str, mime_type: str):
+        """Open a file in the folder for writing as a text stream"""
+        blob_name = (
+            file_name
+            if self.folder_prefix == ""
+            else f"{self.folder_prefix}/{file_name}"
+        )
+        return self.get_bucket().blob(blob_name).open("wt", content_type=mime_type)
 
     @staticmethod
     def base64_to_int(base64_str: str) -> int:
-        crc32c_bytes = base64.b64decode(base64_str)
+        # Local file checksums are recorded URL-safe encoded
+        crc32c_bytes = base64.b64decode(base64_str.replace("-", "+").replace("_", "/"))
         return int.from_bytes(crc32c_bytes, byteorder="big")
 
-    @staticmethod
-    def extract_folder_doc_name(blob_name: str):
-        """split blob name into folder prefix and file"""
-        parts = blob_name.split(r"/")
-        doc_name = parts[-1]
-        folder = "/".join(parts[:-1])
-        return folder, doc_name
-
     @staticmethod
     def extract_bucket_and_folder(gcs_folder_uri: str):
         parts = gcs_folder_uri.replace(r"gs://", "").split(r"/")
@@ -181,44 +286,365 @@ class GCSFolder:
         return bucket_name, folder
 
 
-def look_up_document(registry_table: str, crc32s: list[str]):
-    """Given a list of crc32 values and return all the matching entries from the document registry table"""
+class ChecksumSnapshot:
+    """Sorted array of the crc32 values in the registry, kept as a GCS object
+
+    Checksums are screened against the snapshot locally, so the registry
+    only has to be queried for the ones it contains. The snapshot is updated
+    before rows are added to the registry, so it never misses a checksum;
+    it may hold some no longer in the registry, which only cost a look up.
+    The object holds the distinct values as little-endian uint32."""
+
+    def __init__(self, snapshot_uri: str):
+        self.bucket_name, self.blob_name = GCSFolder.extract_bucket_and_folder(
+            snapshot_uri
+        )
+        self.checksums = array("I")
+        # Generation of the object read (0 if there was none)
+        self.generation: Optional[int] = None
+
+    def __len__(self):
+        return len(self.checksums)
+
+    def __contains__(self, crc32: int) -> bool:
+        i = bisect.bisect_left(self.checksums, crc32)
+        return i < len(self.checksums) and self.checksums[i] == crc32
+
+    def get_blob(self) -> storage.Blob:
+        return (
+            GoogleCloudClients.get_storage_client()
+            .bucket(self.bucket_name)
+            .blob(self.blob_name)
+        )
+
+    def load(self) -> bool:
+        """Read the snapshot object, return False if there is none"""
+        blob = self.get_blob()
+        self.checksums = array("I")
+        try:
+            self.checksums.frombytes(blob.download_as_bytes())
+        except NotFound:
+            self.generation = 0
+            return False
+        if sys.byteorder == "big":
+            self.checksums.byteswap()
+        self.generation = int(blob.generation)
+        return True
+
+    def rebuild(self, registry_table: str):
+        """Read all the checksums from the registry table"""
+        query = f"SELECT DISTINCT crc32 FROM `{registry_table}`"
+        rows = GoogleCloudClients.get_bq_client().query(query).result()
+        self.checksums = array("I", sorted(int(row.crc32) for row in rows))
+        logger.info(f"Rebuilt snapshot of {len(self)} checksums from {registry_table}")
+
+    def add(self, crc32s: Iterable[int]):
+        """Merge checksums into the sorted array"""
+        new_crc32s = sorted(c for c in set(crc32s) if c not in self)
+        if new_crc32s:
+            self.checksums = array("I", heapq.merge(self.checksums, new_crc32s))
+
+    def save(self):
+        """Write the snapshot object, if it was not replaced since read
+
+        Raises PreconditionFailed if it was."""
+        checksums = self.checksums
+        if sys.byteorder == "big":
+            checksums = array("I", checksums)
+            checksums.byteswap()
+        blob = self.get_blob()
+        blob.upload_from_string(
+            checksums.tobytes(),
+            content_type="application/octet-stream",
+            if_generation_match=self.generation,
+        )
+        self.generation = int(blob.generation)
+
+
+def load_checksum_snapshot(snapshot_uri: str, registry_table: str):
+    """Read the checksum snapshot, building it from the registry if missing"""
+    snapshot = ChecksumSnapshot(snapshot_uri)
+    if snapshot.load():
+        return snapshot
+    snapshot.rebuild(registry_table)
+    try:
+        snapshot.save()
+    except PreconditionFailed:
+        # Created concurrently, from the registry as well
+        pass
+    return snapshot
+
+
+def update_checksum_snapshot(
+    snapshot_uri: str, registry_table: str, crc32s: Sequence[int]
+):
+    """Add checksums to the snapshot, retrying when it is concurrently updated"""
+    for attempt in range(1, SNAPSHOT_UPDATE_ATTEMPTS + 1):
+        snapshot = ChecksumSnapshot(snapshot_uri)
+        if not snapshot.load():
+            snapshot.rebuild(registry_table)
+        snapshot.add(crc32s)
+        try:
+            snapshot.save()
+            return snapshot
+        except PreconditionFailed:
+            logger.warning(
+                f"Snapshot {snapshot_uri} updated concurrently (attempt {attempt})"
+            )
+    raise RuntimeError(
+        f"Failed to update snapshot {snapshot_uri} in "
+        f"{SNAPSHOT_UPDATE_ATTEMPTS} attempts"
+    )
+
+
+def look_up_document(
+    registry_table: str,
+    crc32s: list[str],
+    chunk_size: int = LOOK_UP_CHUNK_SIZE,
+    max_workers: int = LOOK_UP_WORKERS,
+):
+    """Given a list of crc32 values and return all the matching entries from the document registry table
+
+    The checksums are passed as an array query parameter, split in chunks
+    that are queried concurrently when there are many of them."""
     unique_crc32s = list(set(crc32s))
-    select_crc32_rows = [f"SELECT '{crc32}' AS crc32" for crc32 in unique_crc32s]
-    crc32_table = " UNION ALL ".join(select_crc32_rows)
-    crc32_table_alias = "crc32_table"
+    if not unique_crc32s:
+        return []
+    chunks = [
+        unique_crc32s[i : i + chunk_size]
+        for i in range(0, len(unique_crc32s), chunk_size)
+    ]
+    if len(chunks) <= 1:
+        return look_up_document_chunk(registry_table, unique_crc32s)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda chunk: look_up_document_chunk(registry_table, chunk), chunks
+        )
+        return [row for rows in results for row in rows]
+
+
+def look_up_document_chunk(registry_table: str, crc32s: list[str]):
+    """Look up the registry entries matching one chunk of crc32 values
+
+    The registry may hold an entry more than once (see append_to_registry),
+    so the entries are made distinct."""
     query = " ".join(
         [
-            f"WITH {crc32_table_alias} AS ({crc32_table})",
-            f"SELECT id, fileName, gcsUri, a.crc32 FROM `{registry_table}` AS a",
-            f"INNER JOIN {crc32_table_alias} AS b",
-            "ON a.crc32 = b.crc32",
+            f"SELECT DISTINCT id, fileName, gcsUri, crc32 FROM `{registry_table}`",
+            "WHERE crc32 IN UNNEST(@crc32s)",
         ]
     )
-    return GoogleCloudClients.get_bq_client().query(query)
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("crc32s", "STRING", crc32s)]
+    )
+    return list(GoogleCloudClients.get_bq_client().query(query, job_config=job_config))
 
 
 def add_new_documents_to_registry(
-    input_table: str, registry_table: str, output_folder: str
+    input_table: str,
+    registry_table: str,
+    output_folder: str,
+    snapshot_uri: Optional[str] = None,
+    max_request_bytes: int = APPEND_MAX_REQUEST_BYTES,
 ):
     """Given a document processing table,
     for each entry insert corresponding entry to document registry table
-    including internal id, gcsUri and crc32"""
-    query = " ".join(
-        [
-            'SELECT JSON_EXTRACT_SCALAR(objs, "$.objid") AS id,',
-            'JSON_EXTRACT_SCALAR(objs, "$.uri") AS uri',
-            f"FROM `{input_table}`",
-            'CROSS JOIN UNNEST(JSON_EXTRACT_ARRAY(PARSE_JSON(jsonData), "$.objs")) AS objs',
+    including internal id, gcsUri and crc32
+
+    The entries are appended in size bounded requests, in a fixed order.
+    A watermark is saved in the output folder after each is committed, so
+    a retried job resumes after it (re-adding at most the last request). The checksums of each request are added
+    to the snapshot (if any) first, so that it holds all the checksums in
+    the registry."""
+    folder = GCSFolder(output_folder)
+    watermark = RegistryWatermark(folder, input_table)
+    watermark.load()
+    if not watermark.complete:
+        if watermark.key is not None:
+            logger.info(f"Resuming after {watermark.added} entries, at {watermark.key}")
+        rows = query_registry_entries(input_table, watermark.key)
+        append_to_registry(
+            registry_table,
+            get_document_infos(rows),
+            watermark,
+            snapshot_uri,
+            max_request_bytes,
+        )
+        watermark.complete = True
+        watermark.save()
+
+    result_obj = {
+        "task": "add-new-documents-to-registry",
+        "result": f"Added {watermark.added} new document entries from {input_table=}",
+    }
+    folder.write_to_folder(json.dumps(result_obj), "result.json", "application/json")
+
+
+class RegistryWatermark:
+    """Key of the last entry of an input table committed to the registry
+
+    Entries are keyed (and ordered) by whether their checksum is missing
+    from the processing metadata, their uri, and their id."""
+
+    file_name = "watermark.json"
+
+    def __init__(self, folder: GCSFolder, input_table: str):
+        self.folder = folder
+        self.input_table = input_table
+        self.key: Optional[tuple[int, str, str]] = None
+        self.added = 0
+        self.complete = False
+
+    def load(self):
+        """Read the watermark of a previous attempt, if any"""
+        content = self.folder.read_from_folder(self.file_name)
+        if content is None:
+            return
+        saved = json.loads(content)
+        if saved["input_table"] != self.input_table:
+            return
+        self.key = tuple(saved["key"]) if saved["key"] else None  # type: ignore
+        self.added = saved["added"]
+        self.complete = saved["complete"]
+
+    def save(self):
+        content = {
+            "input_table": self.input_table,
+            "key": self.key,
+            "added": self.added,
+            "complete": self.complete,
+        }
+        self.folder.write_to_folder(
+            json.dumps(content), self.file_name, "application/json"
+        )
+
+
+def query_registry_entries(
+    input_table: str, after: Optional[tuple[int, str, str]] = None
+):
+    """Query the distinct objects of a document processing table, in key
+    order (the ones without a checksum first), after the given key"""
+    query = [
+        "SELECT id, uri, crc32c, IF(crc32c IS NULL, 0, 1) AS has_crc32c FROM (",
+        'SELECT DISTINCT IFNULL(JSON_EXTRACT_SCALAR(objs, "$.objid"), "") AS id,',
+        'JSON_EXTRACT_SCALAR(objs, "$.uri") AS uri,',
+        'JSON_EXTRACT_SCALAR(objs, "$.crc32c") AS crc32c',
+        f"FROM `{input_table}`",
+        'CROSS JOIN UNNEST(JSON_EXTRACT_ARRAY(jsonData, "$.objs")) AS objs',
+        ")",
+    ]
+    job_config = bigquery.QueryJobConfig()
+    if after is not None:
+        query.extend(
+            [
+                "WHERE IF(crc32c IS NULL, 0, 1) > @has_crc32c",
+                "OR (IF(crc32c IS NULL, 0, 1) = @has_crc32c AND uri > @uri)",
+                "OR (IF(crc32c IS NULL, 0, 1) = @has_crc32c AND uri = @uri AND id > @id)",
+            ]
+        )
+        job_config.query_parameters = [
+            bigquery.ScalarQueryParameter("has_crc32c", "INT64", after[0]),
+            bigquery.ScalarQueryParameter("uri", "STRING", after[1]),
+            bigquery.ScalarQueryParameter("id", "STRING", after[2]),
         ]
+    query.append("ORDER BY has_crc32c, uri, id")
+    return (
+        GoogleCloudClients.get_bq_client()
+        .query(" ".join(query), job_config=job_config)
+        .result(page_size=QUERY_PAGE_SIZE)
     )
-    rows = GoogleCloudClients.get_bq_client().query(query)
-    if rows.result().total_rows == 0:
-        return
-    input_folder = GCSFolder(
-        extract_common_gcs_folder_from_query_result([row.uri for row in rows])
-    )
-    results = input_rows_to_document_info(rows, input_folder)
+
+
+def get_document_infos(rows):
+    """Convert document processing entries to DocumentInfo objects with keys
+
+    The checksums missing from the processing metadata (only recorded for
+    indexed objects, and not by older runs) are taken from a listing of their
+    folder, and entries of objects no longer there are skipped."""
+    rows = iter(rows)
+    to_list = []
+    row = next(rows, None)
+    while row is not None and row.crc32c is None:
+        to_list.append(row)
+        row = next(rows, None)
+
+    if to_list:
+        logger.info(f"Listing the checksums of {len(to_list)} documents")
+        crc32s = list_checksums([r.uri for r in to_list])
+        for r in to_list:
+            if r.uri in crc32s:
+                yield (0, r.uri, r.id), DocumentInfo(
+                    id=r.id,
+                    fileName=r.uri.split("/")[-1],
+                    gcsUri=r.uri,
+                    crc32=str(crc32s[r.uri]),
+                )
+
+    while row is not None:
+        yield (1, row.uri, row.id), DocumentInfo(
+            id=row.id,
+            fileName=row.uri.split("/")[-1],
+            gcsUri=row.uri,
+            crc32=str(GCSFolder.base64_to_int(row.crc32c)),
+        )
+        row = next(rows, None)
+
+
+def list_checksums(
+    uris: list[str], max_list_factor: int = LIST_MAX_FACTOR
+) -> dict[str, int]:
+    """Checksums of objects, from a listing of their common folder
+
+    The listing stops at max_list_factor times the number of objects (the
+    folder holds many other objects), and the checksums not found by then
+    are fetched object by object."""
+    names_by_bucket = collections.defaultdict(set)
+    for uri in uris:
+        bucket_name, name = GCSFolder.extract_bucket_and_folder(uri)
+        names_by_bucket[bucket_name].add(name)
+
+    crc32s = {}
+    for bucket_name, names in names_by_bucket.items():
+        input_folder = GCSFolder(
+            extract_common_gcs_folder_from_query_result(
+                [f"gs://{bucket_name}/{name}" for name in names]
+            )
+        )
+        max_results = max_list_factor * len(names)
+        listed = 0
+        for blob in input_folder.list_blobs(max_results=max_results):
+            listed += 1
+            if blob.name in names:
+                names.remove(blob.name)
+                crc32s[f"gs://{bucket_name}/{blob.name}"] = GCSFolder.base64_to_int(
+                    blob.crc32c
+                )
+        if names and listed >= max_results:
+            logger.info(
+                f"Listed {listed} objects in gs://{bucket_name}/"
+                f"{input_folder.folder_prefix}, fetching {len(names)} more"
+            )
+            for name, crc32 in input_folder.get_checksums(names).items():
+                crc32s[f"gs://{bucket_name}/{name}"] = crc32
+    return crc32s
+
+
+def append_to_registry(
+    registry_table: str,
+    docs: Iterable[tuple[tuple[int, str, str], DocumentInfo]],
+    watermark: RegistryWatermark,
+    snapshot_uri: Optional[str] = None,
+    max_request_bytes: int = APPEND_MAX_REQUEST_BYTES,
+):
+    """Append keyed documents to the registry in size bounded requests,
+    advancing the watermark as each is committed
+
+    The _default stream is at-least-once: if the job fails after a request
+    is committed but before the watermark is saved, the retry appends the
+    rows of that request again. The registry readers tolerate these
+    duplicates (look ups are distinct, the snapshot is a set, and deletes go
+    by id), rather than paying for an exactly-once stream."""
     ref = bigquery.TableReference.from_string(registry_table)
     path = GoogleCloudClients.get_bq_write_stream().write_stream_path(
         project=ref.project,
@@ -227,17 +653,51 @@ def add_new_documents_to_registry(
         stream="_default",
     )
 
-    req = types.AppendRowsRequest()
-    req.write_stream = path
-    req.proto_rows = get_proto_data(results)
-    GoogleCloudClients.get_bq_write_stream().append_rows(requests=iter([req]))
-    result_obj = {
-        "task": "add-new-documents-to-registry",
-        "result": f"Added {len(results)} new document entries from {input_table=}",
-    }
-    GCSFolder(output_folder).write_to_folder(
-        json.dumps(result_obj), "result.json", "application/json"
+    batch: list[DocumentInfo] = []
+    crc32s: list[int] = []
+    size = 0
+    key = None
+
+    def commit():
+        if snapshot_uri:
+            update_checksum_snapshot(snapshot_uri, registry_table, crc32s)
+        append_rows(path, serialize_rows(DocumentInfo, batch))
+        watermark.key = key
+        watermark.added += len(batch)
+        watermark.save()
+        logger.info(f"Committed {watermark.added} entries to the registry")
+
+    to_pb = DocumentInfo.pb
+    for next_key, doc in docs:
+        # Sized without serializing, the request is serialized at once
+        row_size = to_pb(doc).ByteSize() + APPEND_ROW_OVERHEAD
+        if batch and size + row_size > max_request_bytes:
+            commit()
+            batch, crc32s, size = [], [], 0
+        batch.append(doc)
+        crc32s.append(int(doc.crc32))
+        size += row_size
+        key = next_key
+    if batch:
+        commit()
+
+
+def append_rows(write_stream: str, rows: list[bytes]):
+    """Append serialized DocumentInfo rows in one request, waiting for it to
+    be committed"""
+    req = types.AppendRowsRequest(
+        write_stream=write_stream,
+        proto_rows=get_proto_data(DocumentInfo, rows),
+    )
+    responses = GoogleCloudClients.get_bq_write_stream().append_rows(
+        requests=iter([req])
     )
+    for response in responses:
+        if response.error.code or response.row_errors:
+            raise RuntimeError(
+                f"Failed to append {len(rows)} rows to {write_stream}: "
+                f"{response.error.message} {list(response.row_errors)}"
+            )
 
 
 def extract_folder_including_bucket_from_blob_uri(blob_uri: str):
@@ -246,66 +706,87 @@ def extract_folder_including_bucket_from_blob_uri(blob_uri: str):
 
 
 def extract_common_gcs_folder_from_query_result(uris: list[str]):
-    """Extrct the common path share by the list of document uri:s"""
-    max_uri = max(uris, key=len)
-    min_uri = min(uris, key=len)
-    i = 0
-    while i < len(min_uri) and i < len(max_uri) and max_uri[i] == min_uri[i]:
-        i += 1
-    return max_uri[:i]
-
-
-def input_rows_to_document_info(
-    rows, input_folder: GCSFolder
-) -> Sequence[DocumentInfo]:
-    """Convert document processing entries to DocumentInfo object"""
-    uri_look_up = {
-        doc.get_gcs_uri(): doc for doc in input_folder.get_documents_in_folder()
-    }
-    result = []
-    for row in rows:
-        if row.uri in uri_look_up:
-            doc = uri_look_up[row.uri]
-            result.append(
-                DocumentInfo(
-                    id=row.id, fileName=doc.name, gcsUri=row.uri, crc32=str(doc.crc32)
-                )
-            )
-    return result
+    """Extract the deepest folder containing all the document uri:s
 
+    Whole path segments are compared, and the object names are left out."""
+    folders = [uri.replace(r"gs://", "").split(r"/")[:-1] for uri in uris]
+    # The common prefix of the least and greatest lists is common to all
+    return r"gs://" + "/".join(os.path.commonprefix(folders))
+
+
+def detect_duplicates(
+    folder_uri: str,
+    registry_table: str,
+    snapshot_uri: Optional[str] = None,
+    batch_size: int = DETECT_BATCH_SIZE,
+    max_workers: int = LOOK_UP_WORKERS,
+):
+    """Yield the files that already exist in the document registry, as a list
+    for each batch of the listing
 
-def detect_duplicates(folder_uri: str, registry_table: str):
-    """Return all the file that already exist in the document registry"""
+    The folder is listed once, and the batches of documents are looked up
+    concurrently as it is listed. With a checksum snapshot, only the
+    checksums found in it are looked up."""
     folder_to_check = GCSFolder(folder_uri)
-    crc32s = [str(doc.crc32) for doc in folder_to_check.get_documents_in_folder()]
-    matches_found = look_up_document(registry_table, crc32s)
-    duplicates = []
-    match_dict = {row.crc32: row for row in matches_found}
-    for doc in folder_to_check.get_documents_in_folder():
-        doc_crc32 = str(doc.crc32)
-        if doc_crc32 in match_dict:
-            duplicates.append(
-                {
-                    "doc": doc.get_gcs_uri(),
-                    "existing_doc": {
-                        "uri": match_dict[doc_crc32].gcsUri,
-                        "id": match_dict[doc_crc32].id,
-                    },
-                }
+    snapshot = (
+        load_checksum_snapshot(snapshot_uri, registry_table) if snapshot_uri else None
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Results are yielded in listing order, bounding the batches held
+        pending: collections.deque = collections.deque()
+        for batch in folder_to_check.get_checksum_batches(batch_size):
+            pending.append(
+                executor.submit(
+                    detect_duplicates_in_batch, batch, registry_table, snapshot
+                )
             )
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def detect_duplicates_in_batch(
+    batch: ChecksumBatch,
+    registry_table: str,
+    snapshot: Optional[ChecksumSnapshot] = None,
+) -> list[Duplicate]:
+    """Return the documents of a batch that exist in the document registry"""
+    indices = [
+        i
+        for i, crc32 in enumerate(batch.crc32s)
+        if snapshot is None or crc32 in snapshot
+    ]
+    if snapshot is not None:
+        logger.info(f"{len(indices)} of {len(batch)} checksums are in the snapshot")
+    matches_found = look_up_document(
+        registry_table, [str(batch.crc32s[i]) for i in indices]
+    )
+    match_dict = {row.crc32: row for row in matches_found}
+    duplicates = []
+    for i in indices:
+        match = match_dict.get(str(batch.crc32s[i]))
+        if match is not None:
+            duplicates.append(Duplicate(batch.get_gcs_uri(i), match.gcsUri, match.id))
     return duplicates
 
 
-def run_detect_duplicates(folder_to_check, doc_registry_table, output_folder):
-    jsonl_str = "\n".join(
-        [
-            json.dumps(dup)
-            for dup in detect_duplicates(folder_to_check, doc_registry_table)
-        ]
-    )
-    GCSFolder(output_folder).write_to_folder(
-        jsonl_str, "result.jsonl", "application/jsonl"
-    )
+def run_detect_duplicates(
+    folder_to_check, doc_registry_table, output_folder, snapshot_uri=None
+):
+    """Write the duplicates to result.jsonl as they are detected, encoding
+    the lines of each batch at once"""
+    with GCSFolder(output_folder).open_in_folder(
+        "result.jsonl", "application/jsonl"
+    ) as f:
+        separator = ""
+        for duplicates in detect_duplicates(
+            folder_to_check, doc_registry_table, snapshot_uri
+        ):
+            if duplicates:
+                f.write(separator)
+                f.write("\n".join(d.get_json_str() for d in duplicates))
+                separator = "\n"
 
 
 def extract_bucket_and_blob_name(row):
@@ -315,29 +796,30 @@ def extract_bucket_and_blob_name(row):
     return parts[0], "/".join(parts[1:]), parts[-1]
 
 
-def get_proto_data(obj: Sequence[proto.Message], with_schema: bool = True):
-    """Convert a sequence of messages into proto data"""
-
-    proto_data = types.AppendRowsRequest.ProtoData()
+@functools.cache
+def get_proto_schema(message_type: type[proto.Message]) -> types.ProtoSchema:
+    """Writer schema for a message type, copied from its descriptor only once"""
+    proto_descriptor = descriptor_pb2.DescriptorProto()  # pylint: disable=no-member
+    message_type.pb().DESCRIPTOR.CopyToProto(proto_descriptor)
+    return types.ProtoSchema(proto_descriptor=proto_descriptor)
 
-    # Bring in the schema if requested (required first time)
-    if with_schema:
-        proto_schema = types.ProtoSchema()
-        proto_descriptor = descriptor_pb2.DescriptorProto()  # pylint: disable=no-member
-        type(obj[0]).pb().DESCRIPTOR.CopyToProto(proto_descriptor)
-        proto_schema.proto_descriptor = proto_descriptor
-        proto_data.writer_schema = proto_schema
 
-    # Serialize the rows
-    proto_rows = types.ProtoRows()
-    for o in obj:
-        proto_rows.serialized_rows.append(
-            type(o).serialize(o)
-        )  # pylint: disable=no-member
+def serialize_rows(
+    message_type: type[proto.Message], messages: Sequence[proto.Message]
+) -> list[bytes]:
+    """Serialize messages of one type into rows, in bulk"""
+    to_pb = message_type.pb
+    return [to_pb(m).SerializeToString() for m in messages]
 
-    proto_data.rows = proto_rows
 
-    return proto_data
+def get_proto_data(
+    message_type: type[proto.Message], serialized_rows: list[bytes]
+) -> types.AppendRowsRequest.ProtoData:
+    """Proto data of serialized rows, with the writer schema of their type"""
+    return types.AppendRowsRequest.ProtoData(
+        writer_schema=get_proto_schema(message_type),
+        rows=types.ProtoRows(serialized_rows=serialized_rows),
+    )
 
 
 if __name__ == "__main__":
@@ -351,6 +833,7 @@ if __name__ == "__main__":
     BQ_DOC_REGISTRY_TABLE = os.getenv("BQ_DOC_REGISTRY_TABLE")
     ADD_DOCS = os.getenv("ADD_DOCS", "False").lower() in ("true", "1", "t")
     BQ_INGESTED_DOC_TABLE = os.getenv("BQ_INGESTED_DOC_TABLE")
+    GCS_REGISTRY_SNAPSHOT_URI = os.getenv("GCS_REGISTRY_SNAPSHOT_URI")
 
     if not BQ_DOC_REGISTRY_TABLE or not GCS_IO_URI:
         message = (
@@ -373,12 +856,18 @@ if __name__ == "__main__":
         if not ADD_DOCS:
             logger.info(f"{GCS_INPUT_FILE_BUCKET=}, " f"{BQ_DOC_REGISTRY_TABLE=}, ")
             run_detect_duplicates(
-                GCS_INPUT_FILE_BUCKET, BQ_DOC_REGISTRY_TABLE, GCS_IO_URI
+                GCS_INPUT_FILE_BUCKET,
+                BQ_DOC_REGISTRY_TABLE,
+                GCS_IO_URI,
+                GCS_REGISTRY_SNAPSHOT_URI,
             )
         else:
             logger.info(f"{BQ_INGESTED_DOC_TABLE=}, " f"{BQ_DOC_REGISTRY_TABLE=}, ")
             add_new_documents_to_registry(
-                BQ_INGESTED_DOC_TABLE, BQ_DOC_REGISTRY_TABLE, GCS_IO_URI  # type: ignore
+                BQ_INGESTED_DOC_TABLE,  # type: ignore
+                BQ_DOC_REGISTRY_TABLE,
+                GCS_IO_URI,
+                GCS_REGISTRY_SNAPSHOT_URI,
             )
         logger.info(f"Completed Task #{TASK_INDEX} (att. {TASK_ATTEMPT}.")
     except Exception as e:
@@ -0,0 +1,227 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+import unittest
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+from document_registry_service import (
+    ChecksumSnapshot,
+    GCSFolder,
+    GoogleCloudClients,
+    RegistryWatermark,
+    extract_common_gcs_folder_from_query_result,
+    load_checksum_snapshot,
+    update_checksum_snapshot,
+)
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+
+class TestCommonFolder(unittest.TestCase):
+
+    def test_single_uri(self):
+        self.assertEqual(
+            extract_common_gcs_folder_from_query_result(["gs://b/run/x/doc.pdf"]),
+            "gs://b/run/x",
+        )
+
+    def test_common_folder(self):
+        uris = [
+            "gs://b/run/x/a.pdf",
+            "gs://b/run/y/z/b.pdf",
+            "gs://b/run/x/c.pdf",
+        ]
+        self.assertEqual(
+            extract_common_gcs_folder_from_query_result(uris), "gs://b/run"
+        )
+
+    def test_whole_segments(self):
+        # Folders sharing a name prefix are not a common folder
+        uris = ["gs://b/in/run1/a.pdf", "gs://b/in/run10/b.pdf"]
+        self.assertEqual(extract_common_gcs_folder_from_query_result(uris), "gs://b/in")
+
+    def test_bucket_root(self):
+        uris = ["gs://b/a.pdf", "gs://b/run/b.pdf"]
+        self.assertEqual(extract_common_gcs_folder_from_query_result(uris), "gs://b")
+
+    def test_no_common_folder(self):
+        uris = ["gs://b1/run/a.pdf", "gs://b2/run/b.pdf"]
+        self.assertEqual(extract_common_gcs_folder_from_query_result(uris), "gs://")
+
+
+class FakeStorageClient:
+    """Stands in for a storage.Client, keeping objects with their generation
+
+    Callbacks in before_upload run (once each) before the next uploads, to
+    write concurrently."""
+
+    def __init__(self):
+        self.objects: dict[str, tuple[bytes, int]] = {}
+        self.before_upload: list[Callable] = []
+
+    def bucket(self, bucket_name: str):
+        return SimpleNamespace(
+            blob=lambda name: FakeBlob(self, f"{bucket_name}/{name}")
+        )
+
+
+class FakeBlob:
+    def __init__(self, client: FakeStorageClient, path: str):
+        self.client = client
+        self.path = path
+        self.generation: Optional[int] = None
+
+    def download_as_bytes(self) -> bytes:
+        if self.path not in self.client.objects:
+            raise NotFound(self.path)
+        data, self.generation = self.client.objects[self.path]
+        return data
+
+    def download_as_text(self) -> str:
+        return self.download_as_bytes().decode("utf-8")
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        if self.client.before_upload:
+            self.client.before_upload.pop(0)()
+        generation = self.client.objects.get(self.path, (b"", 0))[1]
+        if if_generation_match is not None and if_generation_match != generation:
+            raise PreconditionFailed(self.path)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.client.objects[self.path] = (data, generation + 1)
+        self.generation = generation + 1
+
+
+class FakeBigQueryClient:
+    """Stands in for a bigquery.Client, answering the registry checksums"""
+
+    def __init__(self, crc32s: list[int]):
+        self.crc32s = crc32s
+        self.queries: list[str] = []
+
+    def query(self, query: str):
+        self.queries.append(query)
+        rows = [SimpleNamespace(crc32=str(c)) for c in self.crc32s]
+        return SimpleNamespace(result=lambda: rows)
+
+
+class FakeClientsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = FakeStorageClient()
+        self.bq = FakeBigQueryClient([7, 3, 11])
+        saved = (GoogleCloudClients.storage_client, GoogleCloudClients.bq_client)
+        GoogleCloudClients.storage_client = self.storage
+        GoogleCloudClients.bq_client = self.bq
+
+        def restore():
+            GoogleCloudClients.storage_client, GoogleCloudClients.bq_client = saved
+
+        self.addCleanup(restore)
+
+
+class TestChecksumSnapshot(FakeClientsTestCase):
+
+    uri = "gs://b/snapshot/crc32"
+
+    def test_add(self):
+        snapshot = ChecksumSnapshot(self.uri)
+        snapshot.add([9, 2, 2**32 - 1, 9])
+        snapshot.add([5, 2, 0])
+        self.assertEqual(list(snapshot.checksums), [0, 2, 5, 9, 2**32 - 1])
+        self.assertIn(5, snapshot)
+        self.assertNotIn(6, snapshot)
+        self.assertNotIn(1, snapshot)
+
+    def test_load_rebuild(self):
+        # Built from the registry when missing, created only if still missing
+        snapshot = ChecksumSnapshot(self.uri)
+        self.assertFalse(snapshot.load())
+        self.assertEqual(snapshot.generation, 0)
+
+        snapshot = load_checksum_snapshot(self.uri, "p.d.registry")
+        self.assertEqual(list(snapshot.checksums), [3, 7, 11])
+        self.assertEqual(len(self.bq.queries), 1)
+        # Stored as little-endian uint32
+        data, generation = self.storage.objects["b/snapshot/crc32"]
+        self.assertEqual(data, struct.pack("<3I", 3, 7, 11))
+        self.assertEqual(snapshot.generation, generation)
+
+        snapshot = load_checksum_snapshot(self.uri, "p.d.registry")
+        self.assertEqual(list(snapshot.checksums), [3, 7, 11])
+        self.assertEqual(len(self.bq.queries), 1)
+
+    def test_save_replaced(self):
+        load_checksum_snapshot(self.uri, "p.d.registry")
+        snapshot = ChecksumSnapshot(self.uri)
+        snapshot.load()
+        update_checksum_snapshot(self.uri, "p.d.registry", [1])
+
+        snapshot.add([2])
+        with self.assertRaises(PreconditionFailed):
+            snapshot.save()
+
+    def test_update(self):
+        load_checksum_snapshot(self.uri, "p.d.registry")
+
+        # Merged with the checksums added concurrently
+        self.storage.before_upload.append(
+            lambda: update_checksum_snapshot(self.uri, "p.d.registry", [5])
+        )
+        with self.assertLogs(level="WARNING"):
+            snapshot = update_checksum_snapshot(self.uri, "p.d.registry", [1, 7])
+        self.assertEqual(list(snapshot.checksums), [1, 3, 5, 7, 11])
+
+        snapshot = ChecksumSnapshot(self.uri)
+        snapshot.load()
+        self.assertEqual(list(snapshot.checksums), [1, 3, 5, 7, 11])
+
+
+class TestRegistryWatermark(FakeClientsTestCase):
+
+    def test_load_save(self):
+        folder = GCSFolder("gs://b/results/run")
+        watermark = RegistryWatermark(folder, "p.d.input")
+        # Nothing committed yet
+        watermark.load()
+        self.assertEqual((watermark.key, watermark.added), (None, 0))
+        self.assertFalse(watermark.complete)
+
+        watermark.key = (1, "gs://b/in/a.pdf", "id-1")
+        watermark.added = 5
+        watermark.save()
+        self.assertIn("b/results/run/watermark.json", self.storage.objects)
+
+        resumed = RegistryWatermark(folder, "p.d.input")
+        resumed.load()
+        self.assertEqual(resumed.key, (1, "gs://b/in/a.pdf", "id-1"))
+        self.assertEqual(resumed.added, 5)
+        self.assertFalse(resumed.complete)
+
+        resumed.complete = True
+        resumed.save()
+        watermark.load()
+        self.assertTrue(watermark.complete)
+
+    def test_other_input_table(self):
+        folder = GCSFolder("gs://b/results/run")
+        watermark = RegistryWatermark(folder, "p.d.input")
+        watermark.key = (0, "gs://b/in/a.pdf", "")
+        watermark.save()
+
+        # The watermark of another input table is ignored
+        other = RegistryWatermark(folder, "p.d.other")
+        other.load()
+        self.assertEqual((other.key, other.added), (None, 0))
@@ -90,6 +90,10 @@ resource "google_cloud_run_v2_job" "doc-registry-service-job" {
           name  = "BQ_DOC_REGISTRY_TABLE"
           value = "${var.project_id}.${module.docs_registry_dataset.bigquery_dataset.dataset_id}.${module.docs_registry_dataset.table_ids[0]}"
         }
+        env {
+          name  = "GCS_REGISTRY_SNAPSHOT_URI"
+          value = "gs://${module.registry_snapshot_bucket.name}/crc32-snapshot"
+        }
       }
     }
   }
@@ -206,12 +206,14 @@ def parse_doc_classifier_output(**context):
         task_ids="initial_load_from_input_bucket.create_process_folder",
         key="process_folder",
     )
-    detected_labels = gcs_utils.move_classifier_matched_files(
+    detected_labels, move_stats = gcs_utils.move_classifier_matched_files(
         process_bucket,
         process_folder,
         "pdf",
         list(SPECIALIZED_PROCESSORS_IDS_JSON.keys()),
+        move_workers=context["params"]["classified_docs_move_workers"],
     )
+    context["ti"].xcom_push(key="move_stats", value=move_stats)
     return detected_labels
 
 
@@ -356,6 +358,7 @@ with DAG(
             },
         ),
         "classifier": os.environ.get("CUSTOM_CLASSIFIER_ID", ""),
+        "classified_docs_move_workers": Param(16, type="integer", minimum=1),
     },
 ) as dag:
 
@@ -14,10 +14,34 @@
 
 import json
 import logging
-from typing import Optional, Set
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Set, Tuple
 
 from google.api_core.client_info import ClientInfo
-from google.cloud import documentai, storage
+from google.api_core.retry import Retry, if_transient_error
+from google.cloud import storage
+
+# Maximum number of calls within a GCS batch request
+BATCH_SIZE = 100
+
+# Number of classifier results loaded concurrently
+LOAD_WORKERS = 16
+
+# Number of recent classifier results whose length sets the first read
+READ_LENGTH_WINDOW = 32
+
+# Number of documents moved concurrently
+MOVE_WORKERS = 16
+
+# Transient copy errors are retried with capped, jittered exponential backoff
+MOVE_RETRY = Retry(predicate=if_transient_error, initial=1, maximum=30, timeout=300)
+
+# Number of duplicated documents read before moving them together
+DUPLICATES_MOVE_BATCH_SIZE = 1000
 
 
 class GCSDoc:
@@ -52,6 +76,15 @@ class MoveDoc:
         self.move_info = move_info
 
     def move(self):
+        self.copy()
+        source_bucket = BucketRegistry.get_bucket(self.source_doc.bucket_name)
+        source_bucket.delete_blob(self.source_doc.blob_name)
+        logging.info(
+            f"Moved {self.source_doc.bucket_name}/{self.source_doc.blob_name} "
+            f"to {self.dest_doc.bucket_name}/{self.dest_doc.blob_name}"
+        )
+
+    def copy(self):
         source_bucket = BucketRegistry.get_bucket(self.source_doc.bucket_name)
         source_blob = source_bucket.blob(self.source_doc.blob_name)
         destination_bucket = BucketRegistry.get_bucket(self.dest_doc.bucket_name)
@@ -62,11 +95,104 @@ class MoveDoc:
             destination_bucket.blob(
                 f"{self.dest_doc.blob_name}.json"
             ).upload_from_string(self.move_info, content_type="application/json")
-        source_bucket.delete_blob(self.source_doc.blob_name)
-        logging.info(
-            f"Moved {self.source_doc.bucket_name}/{self.source_doc.blob_name} "
-            f"to {self.dest_doc.bucket_name}/{self.dest_doc.blob_name}"
-        )
+
+    def copy_with_retry(self, retry: Retry = MOVE_RETRY) -> Tuple[float, int]:
+        """Copy, retrying transient errors
+
+        Returns the time taken and the number of retries.
+        """
+        retries = 0
+
+        def on_error(e: Exception):
+            nonlocal retries
+            retries += 1
+            logging.warning(
+                f"Retrying copy of {self.source_doc.bucket_name}/"
+                f"{self.source_doc.blob_name} after error: {e}"
+            )
+
+        start = time.perf_counter()
+        retry(self.copy, on_error=on_error)()
+        return time.perf_counter() - start, retries
+
+    def try_copy(self, retry: Retry = MOVE_RETRY) -> Optional[Tuple[float, int]]:
+        """Copy with retries, logging the error and returning None on failure"""
+        try:
+            return self.copy_with_retry(retry)
+        except Exception as e:
+            logging.error(
+                f"Failed to copy {self.source_doc.bucket_name}/"
+                f"{self.source_doc.blob_name}: {e}"
+            )
+            return None
+
+    @staticmethod
+    def delete_sources(move_docs: list["MoveDoc"]) -> int:
+        """Delete the source documents in batch requests
+
+        Sources already deleted count as deleted; the other failures are
+        logged. Returns the number of sources that could not be deleted.
+        """
+        failures = 0
+        for i in range(0, len(move_docs), BATCH_SIZE):
+            batch_docs = move_docs[i : i + BATCH_SIZE]
+            with BucketRegistry.get_storage_client().batch(
+                raise_exception=False
+            ) as batch:
+                for move_doc in batch_docs:
+                    BucketRegistry.get_bucket(move_doc.source_doc.bucket_name).blob(
+                        move_doc.source_doc.blob_name
+                    ).delete()
+            # One response per delete, in the order they were added
+            for move_doc, response in zip(batch_docs, batch._responses):
+                if 200 <= response.status_code < 300 or response.status_code == 404:
+                    continue
+                failures += 1
+                logging.error(
+                    f"Failed to delete {move_doc.source_doc.bucket_name}/"
+                    f"{move_doc.source_doc.blob_name}: HTTP {response.status_code}"
+                )
+        return failures
+
+    @staticmethod
+    def move_many(
+        move_docs: list["MoveDoc"],
+        max_workers: int = MOVE_WORKERS,
+        retry: Retry = MOVE_RETRY,
+    ) -> dict:
+        """Move documents, copying them concurrently and then deleting the
+        sources in batch requests
+
+        Only the sources whose copy succeeded are deleted, so a failed copy
+        leaves its document in place. Failures are logged and counted in the
+        returned stats, along with aggregated timings of the move.
+        """
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda d: d.try_copy(retry), move_docs))
+        copy_seconds = time.perf_counter() - start
+        copied = [d for d, result in zip(move_docs, results) if result is not None]
+        copies = [result for result in results if result is not None]
+
+        start = time.perf_counter()
+        delete_failures = MoveDoc.delete_sources(copied)
+        delete_seconds = time.perf_counter() - start
+
+        stats = {
+            "documents": len(move_docs),
+            "workers": max_workers,
+            "copy_failures": len(move_docs) - len(copied),
+            "delete_failures": delete_failures,
+            "retries": sum(retries for _, retries in copies),
+            "copy_seconds": round(copy_seconds, 3),
+            "delete_seconds": round(delete_seconds, 3),
+            "mean_copy_seconds": round(
+                sum(t for t, _ in copies) / len(copies) if copies else 0.0, 3
+            ),
+            "max_copy_seconds": round(max((t for t, _ in copies), default=0.0), 3),
+        }
+        logging.info(f"Moved {len(copied)} of {len(move_docs)} documents: {stats}")
+        return stats
 
 
 class BucketRegistry:
@@ -103,16 +229,117 @@ class ClassifierResultEntity:
         )
 
 
+class JsonArrayExtractor:
+    """Incremental extraction of the array value of a top-level JSON key
+
+    The JSON document is fed in chunks, and only the chunks overlapping the
+    array are kept. Scanning stops as soon as the array is complete (or the
+    top-level object ends without the key), so the rest of the document is
+    never read or parsed.
+    """
+
+    STRUCTURAL = re.compile(rb'["{}\[\],:]')
+    STRING_SPECIAL = re.compile(rb'["\\]')
+
+    def __init__(self, key: str):
+        self.key = key
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expect_key = False
+        self.is_key = False
+        self.string = bytearray()
+        self.current_key: Optional[str] = None
+        self.capture: Optional[bytearray] = None
+        self.value: Optional[list] = None
+        self.done = False
+        # Length of the document scanned (up to the end of the array once done)
+        self.length = 0
+
+    def feed(self, chunk: bytes) -> bool:
+        """Scan the next chunk of the document, return True once done"""
+        pos = 0
+        capture_start = 0
+        while pos < len(chunk) and not self.done:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    if self.is_key:
+                        self.string += chunk[pos : pos + 1]
+                    pos += 1
+                    continue
+                m = self.STRING_SPECIAL.search(chunk, pos)
+                end = m.start() if m else len(chunk)
+                if self.is_key:
+                    self.string += chunk[pos:end]
+                if m is None:
+                    pos = end
+                elif chunk[end] == ord("\\"):
+                    if self.is_key:
+                        self.string += b"\\"
+                    self.escape = True
+                    pos = end + 1
+                else:
+                    self.in_string = False
+                    if self.is_key:
+                        self.current_key = json.loads(b'"' + self.string + b'"')
+                    pos = end + 1
+                continue
+
+            m = self.STRUCTURAL.search(chunk, pos)
+            if m is None:
+                break
+            c = chunk[m.start()]
+            pos = m.end()
+            if c == ord('"'):
+                self.in_string = True
+                self.is_key = self.depth == 1 and self.expect_key
+                self.string.clear()
+            elif c in b"{[":
+                if (
+                    self.depth == 1
+                    and c == ord("[")
+                    and self.current_key == self.key
+                    and self.capture is None
+                ):
+                    self.capture = bytearray()
+                    capture_start = m.start()
+                self.depth += 1
+                if self.depth == 1:
+                    self.expect_key = True
+            elif c in b"}]":
+                self.depth -= 1
+                if self.depth == 1 and self.capture is not None:
+                    self.capture += chunk[capture_start:pos]
+                    self.value = json.loads(bytes(self.capture))
+                    self.done = True
+                elif self.depth == 0:
+                    self.done = True
+            elif self.depth == 1 and c == ord(","):
+                self.expect_key = True
+                self.current_key = None
+            elif self.depth == 1 and c == ord(":"):
+                self.expect_key = False
+
+        if self.capture is not None and not self.done:
+            self.capture += chunk[capture_start:]
+        self.length += pos if self.done else len(chunk)
+        return self.done
+
+
 class FormClassifierResult:
 
-    OBJ_ARRAY_END_IDENTIFIER: bytes = b"}]"
-    OBJ_TERMINATION_CHAR: bytes = b"}"
     CONTENT_TYPE_JSON: str = "application/json"
 
     @staticmethod
-    def transform_docai_entity_to_obj(entity):
+    def transform_json_entity_to_obj(entity: dict):
+        # Fields with default values are left out of the Document JSON
         return ClassifierResultEntity(
-            {"confidence": entity.confidence, "id": entity.id, "type": entity.type}
+            {
+                "confidence": entity.get("confidence", 0.0),
+                "id": entity.get("id", ""),
+                "type": entity.get("type", ""),
+            }
         )
 
     @staticmethod
@@ -131,37 +358,54 @@ class FormClassifierResult:
         processing_prefix: str,
         input_file_type: str,
         result_folder_prefix: str,
-        result_content_keywords: list[bytes],
         partial_read_length: int = 128,
+        max_partial_read_length: int = 1024 * 1024,
+        max_workers: int = LOAD_WORKERS,
     ):
         self.bucket_name = bucket_name
         self.processing_prefix = processing_prefix
         self.input_file_type = input_file_type
         self.result_folder_prefix = result_folder_prefix
-        self.content_keywords = result_content_keywords
         self.partial_read_length = partial_read_length
+        self.min_partial_read_length = partial_read_length
+        self.max_partial_read_length = max_partial_read_length
+        self.max_workers = max_workers
         self.results: dict = {}
+        self.lock = threading.Lock()
+        self.read_lengths: deque[int] = deque(maxlen=READ_LENGTH_WINDOW)
+
+        # Statistics, one outcome per file
+        self.prefix_hits = 0
+        self.extended_reads = 0
+        self.full_fallbacks = 0
+        self.failures = 0
+        self.bytes_downloaded = 0
 
     def derive_input_blob_name(self, result_blob_name: str):
         result_doc = GCSDoc(f"{self.bucket_name}/{result_blob_name}")
         input_doc_name = r"-".join(result_doc.get_doc_name().split(r"-")[:-1])
         return f"{self.processing_prefix}/{self.input_file_type}/{input_doc_name}.{self.input_file_type}"
 
+    def count(self, **counters: int):
+        with self.lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
     def extract_classifier_result(self, blob):
         """
         Extracts classifier results from the classifier output JSON file Cloud Storage bucket.
 
         This function efficiently extracts classifier results for the JSON file.
-        To optimize performance, it first attempts to partially download the file
-        (up to `self.partial_read_length` bytes) since classifier results are typically located
-        at the beginning of the file.
-
-        It checks for the presence of specific keywords ('entities', 'form', '}]')
-        to ensure the partial download contains the complete result set. If successful,
-        it parses the downloaded string and returns the extracted entities.
-
-        If partial download fails or encounters errors, it falls back to downloading
-        the entire file and uses the DocAI library for parsing.
+        The file is read in chunks with range downloads, and scanned incrementally
+        for the top-level `entities` array, stopping as soon as the array is
+        complete. Neither the full file nor a `documentai.Document` is ever
+        needed, so large multi-page results cost no more than their entities.
+
+        The first chunk is `self.partial_read_length` bytes (the length that was
+        enough for the recent files), and each following chunk is twice as
+        long, up to `self.max_partial_read_length` bytes. If the array is still
+        incomplete after `self.max_partial_read_length` bytes, or the document
+        cannot be scanned, the complete file is downloaded and parsed instead.
         Args:
             blob: The blob object containing the classifier result JSON file.
 
@@ -169,56 +413,103 @@ class FormClassifierResult:
             A list of `ClassifierResultEntity` objects representing the extracted entities.
         """
 
+        extractor = JsonArrayExtractor("entities")
+        start = 0
+        reads = 0
+        read_length = self.partial_read_length
+        done = False
         try:
-            download_str = blob.download_as_string(
-                start=0, end=self.partial_read_length
-            )
-            if FormClassifierResult.OBJ_ARRAY_END_IDENTIFIER in download_str and all(
-                keyword.lower() in download_str.lower()
-                for keyword in self.content_keywords
-            ):
-                result_obj_str = (
-                    download_str[
-                        : download_str.index(
-                            FormClassifierResult.OBJ_ARRAY_END_IDENTIFIER
-                        )
-                        + 2
-                    ]
-                    + FormClassifierResult.OBJ_TERMINATION_CHAR
+            while start < self.max_partial_read_length:
+                download_str = blob.download_as_bytes(
+                    start=start, end=start + read_length - 1
                 )
-                result_obj = json.loads(result_obj_str)
-                return [ClassifierResultEntity(ent) for ent in result_obj["entities"]]
-        except Exception as e:
+                self.count(bytes_downloaded=len(download_str))
+                reads += 1
+                done = extractor.feed(download_str)
+                start += len(download_str)
+                if done or len(download_str) < read_length:
+                    break
+                read_length = min(read_length * 2, self.max_partial_read_length)
+        except ValueError as e:
+            logging.info(f"Fail to scan classifier result {blob.name}: {e}")
+            done = False
+
+        if done:
+            entities = extractor.value or []
+            self.learn_read_length(extractor.length)
+        else:
             logging.info(
-                f"Fail to extract classifier result using partial download for file: {blob.name}, with error: {e},"
-                f" fall back to download the complete file and use DocAI library to deserialize the result"
+                f"Entities of {blob.name} not found in the first {start} bytes,"
+                f" fall back to download the complete file"
             )
-        document = documentai.Document.from_json(
-            blob.download_as_bytes(), ignore_unknown_fields=True
-        )
-        return [
-            FormClassifierResult.transform_docai_entity_to_obj(e)
-            for e in document.entities
-        ]
+            content = blob.download_as_bytes()
+            self.count(bytes_downloaded=len(content))
+            entities = json.loads(content).get("entities", [])
+            if start >= self.max_partial_read_length:
+                self.learn_read_length(self.max_partial_read_length)
+
+        # One outcome per file, counted once the result is read
+        if not done:
+            self.count(full_fallbacks=1)
+        elif reads == 1:
+            self.count(prefix_hits=1)
+        else:
+            self.count(extended_reads=1)
+        return [FormClassifierResult.transform_json_entity_to_obj(e) for e in entities]
+
+    def learn_read_length(self, length: int):
+        """Start the following files with the length the recent files needed
+        (rounded up to a power of two), following it down as well as up"""
+        with self.lock:
+            self.read_lengths.append(length)
+            needed = 1 << (max(self.read_lengths) - 1).bit_length()
+            self.partial_read_length = min(
+                max(needed, self.min_partial_read_length), self.max_partial_read_length
+            )
+
+    def load_result(self, blob) -> list[ClassifierResultEntity]:
+        """Extract the classifier result of one file, skipping it on errors so
+        the other files are still classified"""
+        try:
+            return self.extract_classifier_result(blob)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.error(f"Skipping classifier result {blob.name}: {e}")
+            self.count(failures=1)
+            return []
 
     def load_results(self):
         blobs = BucketRegistry.get_bucket(self.bucket_name).list_blobs(
             prefix=f"{self.processing_prefix}/{self.result_folder_prefix}",
             match_glob="**/*.json",
         )
-        results = {}
+        json_blobs = [blob for blob in blobs if FormClassifierResult.is_json(blob)]
 
-        for blob in blobs:
-            if not FormClassifierResult.is_json(blob):
-                continue
-
-            input_blob_name = self.derive_input_blob_name(blob.name)
-            if input_blob_name not in results:
-                results[input_blob_name] = []
+        results: dict = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for blob, entities in zip(
+                json_blobs, executor.map(self.load_result, json_blobs)
+            ):
+                input_blob_name = self.derive_input_blob_name(blob.name)
+                if input_blob_name not in results:
+                    results[input_blob_name] = []
 
-            results[input_blob_name].extend(self.extract_classifier_result(blob))
+                results[input_blob_name].extend(entities)
 
         self.results = results
+        logging.info(f"Loaded classifier results: {self.stats()}")
+
+    def stats(self) -> dict:
+        read = self.prefix_hits + self.extended_reads + self.full_fallbacks
+        return {
+            "files": read + self.failures,
+            "prefix_hits": self.prefix_hits,
+            "extended_reads": self.extended_reads,
+            "full_fallbacks": self.full_fallbacks,
+            "failures": self.failures,
+            "prefix_hit_rate": round(self.prefix_hits / read, 3) if read else 0.0,
+            "bytes_downloaded": self.bytes_downloaded,
+            "partial_read_length": self.partial_read_length,
+        }
 
     def get_results(self):
         if not self.results:
@@ -232,17 +523,18 @@ def move_classifier_matched_files(
     input_file_type: str,
     known_labels: list[str],
     classifier_result_folder: str = "classified_pdfs_results",
-    result_content_keywords: list[bytes] = [b"entities", b"form"],
     threshold: float = 0.7,
-) -> Set[str]:
+    move_workers: int = MOVE_WORKERS,
+    move_retry: Retry = MOVE_RETRY,
+) -> Tuple[Set[str], dict]:
     classifier_results = FormClassifierResult(
         process_bucket,
         process_folder,
         input_file_type,
         classifier_result_folder,
-        result_content_keywords,
     )
     detected_labels = set()
+    move_docs = []
     for blob_path in classifier_results.get_results():
         matched_entries = sorted(
             filter(
@@ -255,12 +547,17 @@ def move_classifier_matched_files(
         if matched_entries:
             logging.info(f"Doc: {blob_path} is classified as {matched_entries[0].type}")
             detected_labels.add(matched_entries[0].type.lower())
-            move_doc = MoveDoc(
-                f"{process_bucket}/{blob_path}",
-                f"{process_bucket}/{process_folder}/{input_file_type}-{matched_entries[0].type.lower()}/input",
+            move_docs.append(
+                MoveDoc(
+                    f"{process_bucket}/{blob_path}",
+                    f"{process_bucket}/{process_folder}/{input_file_type}-{matched_entries[0].type.lower()}/input",
+                )
             )
-            move_doc.move()
-    return detected_labels
+    move_stats = MoveDoc.move_many(
+        move_docs, max_workers=move_workers, retry=move_retry
+    )
+    move_stats["classifier_results"] = classifier_results.stats()
+    return detected_labels, move_stats
 
 
 def move_duplicated_files(
@@ -272,13 +569,27 @@ def move_duplicated_files(
     duplicated_file_list_blob = BucketRegistry.get_bucket(
         duplicated_file_list_doc.bucket_name
     ).blob(duplicated_file_list_doc.blob_name)
-    for line in duplicated_file_list_blob.download_as_string().split(b"\n"):
-        if line:
+    duplicated_names: dict[str, set] = defaultdict(set)
+    move_docs = []
+    with duplicated_file_list_blob.open("rt", encoding="utf-8") as lines:
+        for line in lines:
+            line = line.rstrip("\n")
+            if not line:
+                continue
             dup_obj = json.loads(line)
             move_doc = MoveDoc(dup_obj["doc"], destination_folder_ful_uri, line)
-            move_doc.move()
-            process_doc_list = process_files_by_type[move_doc.source_doc.get_doc_type()]
-            if move_doc.source_doc.get_doc_name() in process_doc_list:
-                del process_doc_list[
-                    process_doc_list.index(move_doc.source_doc.get_doc_name())
-                ]
+            duplicated_names[move_doc.source_doc.get_doc_type().lower()].add(
+                move_doc.source_doc.get_doc_name()
+            )
+            move_docs.append(move_doc)
+            if len(move_docs) >= DUPLICATES_MOVE_BATCH_SIZE:
+                MoveDoc.move_many(move_docs)
+                move_docs = []
+    if move_docs:
+        MoveDoc.move_many(move_docs)
+
+    # Remove the duplicates from the files to process (in place)
+    for doc_type, names in duplicated_names.items():
+        process_doc_list = process_files_by_type.get(doc_type)
+        if process_doc_list:
+            process_doc_list[:] = [f for f in process_doc_list if f not in names]
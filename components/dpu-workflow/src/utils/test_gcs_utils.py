@@ -0,0 +1,287 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import unittest
+from types import SimpleNamespace
+
+from google.api_core.exceptions import Forbidden, ServiceUnavailable
+from google.api_core.retry import Retry, if_transient_error
+from utils.gcs_utils import (
+    READ_LENGTH_WINDOW,
+    BucketRegistry,
+    FormClassifierResult,
+    JsonArrayExtractor,
+    MoveDoc,
+)
+
+
+class TestJsonArrayExtractor(unittest.TestCase):
+
+    def extract(self, doc: bytes, chunk_size: int) -> JsonArrayExtractor:
+        extractor = JsonArrayExtractor("entities")
+        for i in range(0, len(doc), chunk_size):
+            if extractor.feed(doc[i : i + chunk_size]):
+                break
+        return extractor
+
+    def do_extract_test(self, doc: bytes, expected):
+        # Whole, and split at every position (e.g. within escapes)
+        for chunk_size in (len(doc), 1, 2, 7):
+            extractor = self.extract(doc, chunk_size)
+            self.assertTrue(extractor.done)
+            self.assertEqual(extractor.value, expected)
+
+    def test_entities(self):
+        entities = [
+            {"type": "invoice", "confidence": 0.9, "id": "0"},
+            {"type": "form", "confidence": 0.1, "id": "1"},
+        ]
+        doc = {"uri": "", "entities": entities, "pages": [{"pageNumber": 1}]}
+        self.do_extract_test(bytes(json.dumps(doc), "utf8"), entities)
+
+    def test_escaped_strings(self):
+        # Quotes, brackets and the key itself within strings are not structure
+        entities = [{"type": 'for"m]}', "id": "\\"}, {"mentionText": '[{"x": 1}'}]
+        doc = {
+            "text": '"entities": [1]} \\" ]',
+            'enti"ties': [2],
+            "nested": {"entities": [3]},
+            "entities": entities,
+        }
+        self.do_extract_test(bytes(json.dumps(doc), "utf8"), entities)
+
+    def test_empty_entities(self):
+        self.do_extract_test(b'{"entities": [], "pages": [{}]}', [])
+
+    def test_no_entities(self):
+        self.do_extract_test(b'{"text": "entities", "pages": [[]]}', None)
+
+    def test_stops_after_entities(self):
+        # The rest of the document is neither needed nor parsed
+        extractor = JsonArrayExtractor("entities")
+        self.assertTrue(extractor.feed(b'{"entities": [{"id": "0"}], "pages": [{'))
+        self.assertEqual(extractor.value, [{"id": "0"}])
+
+    def test_incomplete(self):
+        doc = b'{"text": "x", "entities": [{"type": "form", "id": "0"}, {"ty'
+        for chunk_size in (len(doc), 1, 5):
+            extractor = self.extract(doc, chunk_size)
+            self.assertFalse(extractor.done)
+            self.assertIsNone(extractor.value)
+
+
+class FakeBlob:
+    """Stands in for a storage.Blob, recording the ranges downloaded"""
+
+    def __init__(self, name: str, data: bytes):
+        self.name = name
+        self.data = data
+        self.ranges: list[tuple] = []
+
+    def download_as_bytes(self, start=None, end=None):
+        self.ranges.append((start, end))
+        start = start or 0
+        end = len(self.data) if end is None else end + 1
+        return self.data[start:end]
+
+
+class TestFormClassifierResult(unittest.TestCase):
+
+    def setUp(self):
+        self.result = FormClassifierResult(
+            "bucket",
+            "folder",
+            "pdf",
+            "results",
+            partial_read_length=16,
+            max_partial_read_length=64,
+        )
+        self.entities = [{"type": "invoice", "confidence": 0.9, "id": "0"}]
+
+    def assert_entities(self, entities):
+        self.assertEqual(
+            [(e.type, e.confidence, e.id) for e in entities],
+            [(e["type"], e["confidence"], e["id"]) for e in self.entities],
+        )
+
+    def test_partial(self):
+        doc = {"entities": self.entities, "text": "x" * 1000}
+        blob = FakeBlob("r-0.json", bytes(json.dumps(doc), "utf8"))
+        self.assert_entities(self.result.extract_classifier_result(blob))
+        # Only ranges (of increasing size) up to the entities are read
+        self.assertNotIn((None, None), blob.ranges)
+        self.assertLess(self.result.bytes_downloaded, len(blob.data) // 4)
+
+    def test_full_fallback(self):
+        # Entities beyond the partial read cap, in full or cut in the middle
+        for text in ("x" * 100, "x" * 40):
+            doc = {"text": text, "entities": self.entities}
+            blob = FakeBlob("r-0.json", bytes(json.dumps(doc), "utf8"))
+            self.assert_entities(self.result.extract_classifier_result(blob))
+            self.assertEqual(blob.ranges[-1], (None, None))
+
+    def test_malformed(self):
+        blob = FakeBlob("r-0.json", b'{"entities": [{"type": "in')
+        with self.assertRaises(ValueError):
+            self.result.extract_classifier_result(blob)
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(self.result.load_result(blob), [])
+
+    def test_stats(self):
+        result = FormClassifierResult(
+            "bucket",
+            "folder",
+            "pdf",
+            "results",
+            partial_read_length=16,
+            max_partial_read_length=1024,
+        )
+        doc = bytes(json.dumps({"entities": self.entities, "text": "x" * 100}), "utf8")
+        large = bytes(json.dumps({"text": "x" * 2000, "entities": []}), "utf8")
+        small = b'{"entities": []}'
+
+        # Extended past the first read, then learned for the next file
+        result.extract_classifier_result(FakeBlob("r-0.json", doc))
+        self.assertEqual(result.partial_read_length, 64)
+        result.extract_classifier_result(FakeBlob("r-0.json", doc))
+        # A file shorter than the first read is only a prefix hit
+        result.extract_classifier_result(FakeBlob("r-0.json", small))
+        result.extract_classifier_result(FakeBlob("r-0.json", large))
+        self.assertEqual(result.partial_read_length, 1024)
+        result.load_result(FakeBlob("r-0.json", b"{"))
+
+        stats = result.stats()
+        self.assertEqual(
+            [stats[k] for k in ("prefix_hits", "extended_reads", "full_fallbacks")],
+            [2, 1, 1],
+        )
+        self.assertEqual(stats["failures"], 1)
+        self.assertEqual(stats["files"], 5)
+        self.assertEqual(stats["prefix_hit_rate"], 0.5)
+
+        # Shrinks back once the recent files need less
+        for _ in range(READ_LENGTH_WINDOW):
+            result.extract_classifier_result(FakeBlob("r-0.json", small))
+        self.assertEqual(result.partial_read_length, 16)
+
+
+class FakeStorageClient:
+    """Stands in for a storage.Client: copies fail with the errors queued
+    per source, and batched deletes get the status set per source"""
+
+    def __init__(self):
+        self.objects: set[str] = set()
+        self.copy_errors: dict[str, list] = {}
+        self.delete_status: dict[str, int] = {}
+        self.current_batch = None
+        self.raise_exception = None
+
+    def bucket(self, bucket_name: str):
+        return FakeBucket(self, bucket_name)
+
+    def batch(self, raise_exception=True):
+        self.raise_exception = raise_exception
+        return FakeBatch(self)
+
+
+class FakeBatch:
+    def __init__(self, client: FakeStorageClient):
+        self.client = client
+        self.deletes: list[str] = []
+        self._responses: list = []
+
+    def __enter__(self):
+        self.client.current_batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.client.current_batch = None
+        for path in self.deletes:
+            status = self.client.delete_status.get(path, 204)
+            if status == 204:
+                self.client.objects.discard(path)
+            self._responses.append(SimpleNamespace(status_code=status))
+
+
+class FakeBucket:
+    def __init__(self, client: FakeStorageClient, name: str):
+        self.client = client
+        self.name = name
+
+    def blob(self, blob_name: str):
+        path = f"{self.name}/{blob_name}"
+        return SimpleNamespace(
+            path=path, delete=lambda: self.client.current_batch.deletes.append(path)
+        )
+
+    def copy_blob(self, source_blob, destination_bucket, new_name):
+        errors = self.client.copy_errors.get(source_blob.path)
+        if errors:
+            raise errors.pop(0)
+        self.client.objects.add(f"{destination_bucket.name}/{new_name}")
+
+
+class TestMoveDoc(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeStorageClient()
+        self.saved = (BucketRegistry.storage_client, BucketRegistry.bucket_dict)
+        BucketRegistry.storage_client = self.client
+        BucketRegistry.bucket_dict = {}
+        self.retry = Retry(
+            predicate=if_transient_error, initial=0.01, maximum=0.01, timeout=5
+        )
+        self.sources = [f"in/folder/doc-{i}.pdf" for i in range(5)]
+        self.client.objects.update(self.sources)
+
+    def tearDown(self):
+        BucketRegistry.storage_client, BucketRegistry.bucket_dict = self.saved
+
+    def move_many(self) -> dict:
+        move_docs = [MoveDoc(source, "out/moved") for source in self.sources]
+        return MoveDoc.move_many(move_docs, max_workers=2, retry=self.retry)
+
+    def test_move(self):
+        self.client.copy_errors[self.sources[0]] = [ServiceUnavailable("x")] * 2
+        stats = self.move_many()
+        self.assertEqual(
+            self.client.objects, {f"out/moved/doc-{i}.pdf" for i in range(5)}
+        )
+        self.assertEqual(stats["retries"], 2)
+        self.assertEqual((stats["copy_failures"], stats["delete_failures"]), (0, 0))
+
+    def test_copy_failure(self):
+        # Only the sources copied are deleted
+        self.client.copy_errors[self.sources[1]] = [Forbidden("x")]
+        with self.assertLogs(level="ERROR"):
+            stats = self.move_many()
+        self.assertIn(self.sources[1], self.client.objects)
+        self.assertNotIn("out/moved/doc-1.pdf", self.client.objects)
+        self.assertFalse(set(self.sources) - {self.sources[1]} & self.client.objects)
+        self.assertEqual((stats["copy_failures"], stats["delete_failures"]), (1, 0))
+
+    def test_delete_failures(self):
+        # A source already deleted is not a failure, nor stops the other deletes
+        self.client.delete_status[self.sources[0]] = 404
+        self.client.delete_status[self.sources[2]] = 503
+        with self.assertLogs(level="ERROR"):
+            stats = self.move_many()
+        self.assertEqual(
+            set(self.sources) & self.client.objects,
+            {self.sources[0], self.sources[2]},
+        )
+        self.assertEqual((stats["copy_failures"], stats["delete_failures"]), (0, 1))
+        self.assertIs(self.client.raise_exception, False)
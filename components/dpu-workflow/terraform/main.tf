@@ -108,7 +108,10 @@ resource "google_composer_environment" "composer_env" {
 }
 
 resource "google_storage_bucket_object" "workflow_orchestrator_dag" {
-  for_each       = fileset("${path.module}/../src", "**/*.py")
+  for_each = setsubtract(
+    fileset("${path.module}/../src", "**/*.py"),
+    fileset("${path.module}/../src", "**/test_*.py"),
+  )
   name           = "dags/${each.value}"
   bucket         = google_composer_environment.composer_env.storage_config[0].bucket
   source         = "${path.module}/../src/${each.value}"
@@ -0,0 +1,171 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-benchmarks for the processor base utilities"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import timeit
+import uuid
+from typing import Sequence
+
+import proto
+from google.cloud.bigquery_storage_v1 import types  # type: ignore[import-untyped]
+from google.protobuf import descriptor_pb2
+from processors.base.gcsio import GCSPath
+from processors.base.result_writer import DocumentMetadata, get_row_serializer
+
+
+def get_proto_data_per_row(obj: Sequence[proto.Message], with_schema: bool = True):
+    """Previous proto data conversion (descriptor copied and rows serialized
+    one by one on every call), kept as the baseline"""
+    proto_data = types.AppendRowsRequest.ProtoData()
+    if with_schema:
+        proto_schema = types.ProtoSchema()
+        proto_descriptor = descriptor_pb2.DescriptorProto()  # pylint: disable=no-member
+        type(obj[0]).pb().DESCRIPTOR.CopyToProto(proto_descriptor)
+        proto_schema.proto_descriptor = proto_descriptor
+        proto_data.writer_schema = proto_schema
+    proto_rows = types.ProtoRows()
+    for o in obj:
+        proto_rows.serialized_rows.append(type(o).serialize(o))
+    proto_data.rows = proto_rows
+    return proto_data
+
+
+def benchmark_serialization(args):
+    """Per-row cost of building AppendRows proto data"""
+    rows = [
+        DocumentMetadata(
+            id=f"id-{i}",
+            jsonData=json.dumps({"objs": [{"uri": f"gs://bucket/doc-{i}.txt"}]}),
+            content=DocumentMetadata.Content(
+                mimeType="text/plain", uri=f"gs://bucket/doc-{i}.txt"
+            ),
+        )
+        for i in range(args.rows)
+    ]
+    serializer = get_row_serializer(DocumentMetadata)
+
+    print(f"{'batch':>8} {'before us/row':>14} {'after us/row':>13} {'speedup':>8}")
+    for batch in args.batch:
+        chunks = [rows[i : i + batch] for i in range(0, len(rows), batch)]
+        before = min(
+            timeit.repeat(
+                lambda: [get_proto_data_per_row(c) for c in chunks],
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        after = min(
+            timeit.repeat(
+                lambda: [serializer.get_proto_data(c) for c in chunks],
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(
+            f"{batch:>8} {before / len(rows) * 1e6:>14.2f} "
+            f"{after / len(rows) * 1e6:>13.2f} {before / after:>7.2f}x"
+        )
+
+
+def benchmark_transfer(args):
+    """Folder upload and download time against GCS by concurrency"""
+    with tempfile.TemporaryDirectory() as d:
+        source = os.path.join(d, "source")
+        for i in range(args.files):
+            path = os.path.join(source, f"dir-{i % 10}", f"file-{i:06d}.txt")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(os.urandom(args.size))
+
+        print(f"{args.files} files of {args.size} bytes, below {args.gcs_dir}")
+        print(f"{'workers':>8} {'upload s':>9} {'download s':>11}")
+        for workers in args.workers:
+            prefix = GCSPath(args.gcs_dir, f"transfer-benchmark-{uuid.uuid4()}")
+
+            start = time.perf_counter()
+            prefix.upload_folder(source, max_workers=workers)
+            upload = time.perf_counter() - start
+
+            start = time.perf_counter()
+            prefix.download_folder(
+                os.path.join(d, f"download-{workers}"),
+                max_workers=workers,
+                delete=True,
+            )
+            download = time.perf_counter() - start
+
+            print(f"{workers:>8} {upload:>9.2f} {download:>11.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="base_benchmark",
+        description="Micro-benchmarks for the processor base utilities",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(required=True)
+
+    serialization = subparsers.add_parser(
+        "serialization",
+        help=benchmark_serialization.__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    serialization.add_argument(
+        "--rows", type=int, default=10000, help="Rows to serialize"
+    )
+    serialization.add_argument(
+        "--batch",
+        type=int,
+        nargs="+",
+        default=[1, 100, 500],
+        help="Rows per AppendRows request",
+    )
+    serialization.add_argument(
+        "--repeat", type=int, default=5, help="Repetitions (best is reported)"
+    )
+    serialization.set_defaults(func=benchmark_serialization)
+
+    transfer = subparsers.add_parser(
+        "transfer",
+        help=benchmark_transfer.__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    transfer.add_argument(
+        "--gcs_dir",
+        default=os.getenv("GCS_TMP_PREFIX"),
+        type=str,
+        help="GCS prefix for the transferred objects",
+    )
+    transfer.add_argument("--files", type=int, default=1000, help="Files in folder")
+    transfer.add_argument("--size", type=int, default=4096, help="Bytes per file")
+    transfer.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 4, 8],
+        help="Concurrent transfers (1 is the previous serial behaviour)",
+    )
+    transfer.set_defaults(func=benchmark_transfer)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,13 +13,15 @@
 # limitations under the License.
 """Utilities for abstracting over GCS objects, paths, and local files and paths
 
-    These utilities enable to build code that will work equally well using GCS as
-    using local filesystems within Python.
+These utilities enable to build code that will work equally well using GCS as
+using local filesystems within Python.
 """
+
 import base64
 import contextlib
 import functools
 import hashlib
+import io
 import json
 import logging
 import mimetypes
@@ -27,12 +29,17 @@ import os
 import re
 import shutil
 import tempfile
+import threading
 import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Iterator, Optional, TypeVar
 
 from google.api_core.client_info import ClientInfo
+from google.api_core.exceptions import NotFound
 from google.cloud import storage  # type: ignore[attr-defined, import-untyped]
+from google.cloud.storage import transfer_manager  # type: ignore[import-untyped]
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +47,18 @@ logger = logging.getLogger(__name__)
 # Update the timeout for operations
 storage._DEFAULT_TIMEOUT = 300  # pyright: ignore  pylint: disable=protected-access
 
+# Maximum number of calls within a GCS batch request
+BATCH_SIZE = 100
+
+# Random access reads: block size, blocks cached, and maximum read-ahead
+# (in blocks) for sequential reads
+RANGE_BLOCK_SIZE = 256 * 1024
+RANGE_CACHE_BLOCKS = 64
+RANGE_MAX_READ_AHEAD = 32
+
+# Largest object copied into the download cache when opened for random access
+DOWNLOAD_CACHE_MAX_OBJECT_SIZE = 64 * 1024 * 1024
+
 
 def GCS_TMP_PREFIX():  # pylint: disable=invalid-name
     """Return the temporary GCS location"""
@@ -59,6 +78,268 @@ def get_mimetype(path: str) -> str:
     return "application/octet-stream"
 
 
+@dataclass(frozen=True)
+class ObjectMetadata:
+    """Metadata of a GCS object, as returned by a get or a listing"""
+
+    size: int
+    crc32c: str
+    content_type: Optional[str] = None
+    generation: Optional[int] = None
+
+    @classmethod
+    def from_blob(cls, blob: storage.Blob) -> "ObjectMetadata":
+        """Metadata from a blob with its properties loaded"""
+        return cls(
+            size=blob.size,  # pyright: ignore
+            crc32c=blob.crc32c,  # pyright: ignore
+            content_type=blob.content_type,
+            generation=blob.generation,
+        )
+
+
+def delete_blobs(blobs: list[storage.Blob]):
+    """Delete objects, grouping the deletes into batch requests"""
+    for i in range(0, len(blobs), BATCH_SIZE):
+        with blobs[i].client.batch():
+            for blob in blobs[i : i + BATCH_SIZE]:
+                blob.delete()
+
+
+class RangeReader(io.RawIOBase):
+    """Seekable read-only view of a GCS object, read with range requests
+
+    The object is fetched in blocks, kept in an LRU cache. Sequential reads
+    grow the read-ahead (blocks fetched per request), up to a maximum, while
+    a seek elsewhere resets it to one block.
+    """
+
+    def __init__(
+        self,
+        blob: storage.Blob,
+        size: int,
+        block_size: int = RANGE_BLOCK_SIZE,
+        cache_blocks: int = RANGE_CACHE_BLOCKS,
+        max_read_ahead: int = RANGE_MAX_READ_AHEAD,
+    ):
+        self.blob = blob
+        self.length = size
+        self.position = 0
+        self.block_size = block_size
+        self.cache_blocks = max(cache_blocks, max_read_ahead)
+        self.max_read_ahead = max_read_ahead
+        self.blocks: OrderedDict[int, bytes] = OrderedDict()
+        self.read_ahead = 1
+        self.last_fetched = -1
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.length + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self.position = position
+        return position
+
+    def readinto(self, b) -> int:
+        view = memoryview(b).cast("B")
+        size = min(len(view), self.length - self.position)
+        done = 0
+        while done < size:
+            index, offset = divmod(self.position, self.block_size)
+            block = self.get_block(index)
+            count = min(size - done, len(block) - offset)
+            view[done : done + count] = block[offset : offset + count]
+            done += count
+            self.position += count
+        return max(done, 0)
+
+    def get_block(self, index: int) -> bytes:
+        """Get a block from the cache, or fetch it with its read-ahead"""
+        block = self.blocks.get(index)
+        if block is not None:
+            self.hits += 1
+            self.blocks.move_to_end(index)
+            return block
+        self.misses += 1
+
+        # Sequential access doubles the read-ahead, any other resets it
+        if index == self.last_fetched + 1:
+            self.read_ahead = min(self.read_ahead * 2, self.max_read_ahead)
+        else:
+            self.read_ahead = 1
+
+        # Fetch up to the next cached block (or the end of the object)
+        last = min(index + self.read_ahead, -(-self.length // self.block_size))
+        for i in range(index + 1, last):
+            if i in self.blocks:
+                last = i
+                break
+        start = index * self.block_size
+        end = min(last * self.block_size, self.length)
+        data = self.blob.download_as_bytes(start=start, end=end - 1, checksum=None)
+        self.requests += 1
+        self.bytes_fetched += len(data)
+
+        for i in range(index, last):
+            offset = (i - index) * self.block_size
+            self.blocks[i] = data[offset : offset + self.block_size]
+        while len(self.blocks) > self.cache_blocks:
+            self.blocks.popitem(last=False)
+        self.last_fetched = last - 1
+        return self.blocks[index]
+
+    def close(self):
+        if not self.closed:
+            logger.debug(
+                "Read %s: %d requests, %d bytes fetched, %d hits, %d misses",
+                self.blob.name,
+                self.requests,
+                self.bytes_fetched,
+                self.hits,
+                self.misses,
+            )
+            self.blocks.clear()
+        super().close()
+
+
+class DownloadCache:
+    """On-disk cache of downloaded objects, keyed by their content
+
+    Objects are stored by (crc32c, size), so a cached copy stays valid
+    whatever the object is named or however often it is rewritten. The
+    total size is capped, evicting the least recently used files first. The
+    folder can be shared by processes, eviction goes by the file times.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        max_object_size: int = DOWNLOAD_CACHE_MAX_OBJECT_SIZE,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.total = sum(e.stat().st_size for e in self.entries())
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Worker processes share the folder, with their own lock and counters
+    def __getstate__(self):
+        return (self.directory, self.max_bytes, self.max_object_size)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def cached_path(self, metadata: ObjectMetadata) -> str:
+        """Path of the cached copy of an object (whether it exists or not)"""
+        key = base64.b64decode(metadata.crc32c).hex()
+        return os.path.join(self.directory, f"{key}-{metadata.size}")
+
+    def get(self, metadata: ObjectMetadata) -> Optional[str]:
+        """Path of the cached copy of an object, if there is one"""
+        path = self.cached_path(metadata)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def fetch(self, blob: storage.Blob, metadata: ObjectMetadata) -> str:
+        """Path of the cached copy of an object, downloading it if missing"""
+        path = self.get(metadata)
+        if path is not None:
+            return path
+
+        path = self.cached_path(metadata)
+        with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as w:
+            try:
+                blob.download_to_file(w)
+            except Exception:
+                os.unlink(w.name)
+                raise
+        os.replace(w.name, path)
+
+        with self.lock:
+            self.total += metadata.size
+            if self.total > self.max_bytes:
+                self.evict(keep=path)
+        return path
+
+    def evict(self, keep: str):
+        """Remove the least recently used files until within the size cap"""
+        entries = sorted(self.entries(), key=lambda e: e.stat().st_mtime)
+        self.total = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if self.total <= self.max_bytes:
+                break
+            if entry.path == keep:
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(entry.path)
+                self.evictions += 1
+            self.total -= entry.stat().st_size
+
+    def entries(self) -> list[os.DirEntry]:
+        """Cached files (leaving out downloads in progress)"""
+        return [
+            e
+            for e in os.scandir(self.directory)
+            if e.is_file() and not e.name.startswith(tempfile.gettempprefix())
+        ]
+
+    def counters(self) -> dict:
+        """Hits, misses and evictions so far in this process"""
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+    def add_counters(self, counters: dict):
+        """Add the counters of another process (e.g. a worker) to these"""
+        with self.lock:
+            self.hits += counters.get("hits", 0)
+            self.misses += counters.get("misses", 0)
+            self.evictions += counters.get("evictions", 0)
+
+    def stats(self) -> dict:
+        """Counters for tuning the cache"""
+        # Workers fill the folder too, so size it rather than trust self.total
+        return dict(
+            self.counters(),
+            bytes=sum(e.stat().st_size for e in self.entries()),
+        )
+
+
 TGCSPath = TypeVar("TGCSPath", bound="GCSPath")  # pylint: disable=invalid-name
 
 
@@ -66,26 +347,37 @@ class GCSPath:
     """GCSPath - abstraction for a path that can be a local or GCS object or path"""
 
     client: Optional[storage.Client] = None
+    buckets: dict = {}
+
+    # Number of concurrent transfers when uploading or downloading folders
+    transfer_workers: int = transfer_manager.DEFAULT_MAX_WORKERS
+
+    # Optional cache of downloaded objects, shared by all paths
+    download_cache: Optional[DownloadCache] = None
 
     @classmethod
     def open_bucket(cls, bucket: str):
-        """Open a bucket."""
+        """Open a bucket (shared by all paths within that bucket)."""
         if cls.client is None:
             cls.client = storage.Client(
                 client_info=ClientInfo(
                     user_agent="cloud-solutions/eks-doc-processors-v1",
                 )
             )
-        return cls.client.bucket(bucket)  # pyright: ignore
+        if bucket not in cls.buckets:
+            cls.buckets[bucket] = cls.client.bucket(bucket)  # pyright: ignore
+        return cls.buckets[bucket]
 
     def __init__(
         self,
         *paths: TGCSPath | str,
         crc32c: Optional[str] = None,
+        metadata: Optional[ObjectMetadata] = None,
     ):
         self.bucket: Optional[storage.Bucket] = None
         self.path: str
         self.preset_crc32c = crc32c
+        self.preset_metadata = metadata
 
         gcs_test_path = "/".join([str(x) for x in paths])
         gcs_match = re.match(r"gs://([^/]+)/(.*)", gcs_test_path)
@@ -115,15 +407,52 @@ class GCSPath:
     def exists(self) -> bool:
         """Return if object or path exists"""
         if self.bucket:
-            return self.bucket.blob(self.path).exists()
+            # Always asked of GCS, as the object may have been written or
+            # deleted since the metadata was cached. Fetching the metadata
+            # costs the same round trip, so it is refreshed on the way.
+            blob = self.bucket.blob(self.path)
+            try:
+                blob.reload()
+            except NotFound:
+                self.set_metadata()
+                return False
+            self.set_metadata(blob)
+            return True
         return Path(self.path).exists()
 
+    # Object metadata, fetched once
+    @property
+    def metadata(self) -> ObjectMetadata:
+        """Get the metadata of the object (only valid if it is GCS)
+
+        The metadata is fetched once and cached (or preset from a listing),
+        and refreshed when the object is written or deleted through this path,
+        or checked with exists().
+        """
+        if self.preset_metadata is None:
+            if not self.bucket:
+                raise ValueError(f"No object metadata for local file {self}")
+            blob = self.bucket.blob(self.path)
+            blob.reload()
+            self.preset_metadata = ObjectMetadata.from_blob(blob)
+        return self.preset_metadata
+
+    def set_metadata(self, blob: Optional[storage.Blob] = None):
+        """Replace cached metadata after a write (from the blob, if known)"""
+        self.preset_crc32c = None
+        self.preset_metadata = None
+        for prop in ["crc32c", "size"]:
+            self.__dict__.pop(prop, None)
+        if blob is not None and blob.crc32c is not None:
+            self.preset_metadata = ObjectMetadata.from_blob(blob)
+
     # Open file/blob for read/write
     def open(self, mode, encoding=None):
         """Open for reading/writing"""
         logger.debug("Opening %s with open %s", str(self), mode)
         if self.bucket:
             if mode[0] == "w":
+                self.set_metadata()
                 return self.bucket.blob(self.path).open(
                     content_type=self.mimetype, mode=mode
                 )
@@ -135,6 +464,42 @@ class GCSPath:
 
         return open(self.path, mode=mode, encoding=encoding)
 
+    def open_random_access(
+        self,
+        block_size: int = RANGE_BLOCK_SIZE,
+        cache_blocks: int = RANGE_CACHE_BLOCKS,
+        max_read_ahead: int = RANGE_MAX_READ_AHEAD,
+    ):
+        """Open for seekable binary reading
+
+        Objects are not downloaded, the blocks read are fetched on demand with
+        range requests (pinned to the generation first seen, so a concurrent
+        overwrite cannot mix contents) and kept in an LRU cache.
+        """
+        logger.debug("Opening %s for random access", str(self))
+        if not self.bucket:
+            return open(self.path, mode="rb")
+
+        metadata = self.metadata
+        blob = self.bucket.blob(self.path, generation=metadata.generation)
+        cache = self.download_cache
+        if cache is not None:
+            if metadata.size <= cache.max_object_size:
+                return open(cache.fetch(blob, metadata), mode="rb")
+            path = cache.get(metadata)
+            if path is not None:
+                return open(path, mode="rb")
+
+        return io.BufferedReader(
+            RangeReader(
+                blob,
+                metadata.size,
+                block_size=block_size,
+                cache_blocks=cache_blocks,
+                max_read_ahead=max_read_ahead,
+            )
+        )
+
     # Move objects / files
     def move(self, dest: str | TGCSPath):
         """Move current object (file) to a target object (file)"""
@@ -160,6 +525,7 @@ class GCSPath:
             token, _, _ = dst.rewrite(source=src)
             while token is not None:
                 token, _, _ = dst.rewrite(source=src, token=token)
+            dest.set_metadata(dst)
 
         # Make local directories if necessary
         if not dest.bucket:
@@ -181,10 +547,12 @@ class GCSPath:
             if dest.bucket:
                 # Upload to GCS
                 logger.debug("Uploading from %s to %s", str(self), str(dest))
-                dest.bucket.blob(dest.path).upload_from_filename(
+                dst = dest.bucket.blob(dest.path)
+                dst.upload_from_filename(
                     str(self),
                     content_type=get_mimetype(dest.path),
                 )
+                dest.set_metadata(dst)
                 if delete_orig:
                     self.delete()
             else:
@@ -202,9 +570,9 @@ class GCSPath:
         """Write text to the object or file"""
         logger.debug("Writing text to %s", str(self))
         if self.bucket:
-            self.bucket.blob(self.path).upload_from_string(
-                txt, content_type=self.mimetype
-            )
+            blob = self.bucket.blob(self.path)
+            blob.upload_from_string(txt, content_type=self.mimetype)
+            self.set_metadata(blob)
             return
 
         os.makedirs(Path(self.path).parent, exist_ok=True)
@@ -217,11 +585,13 @@ class GCSPath:
         """Write bytes to the object or file"""
         logger.debug("Writing bytes to %s", str(self))
         if self.bucket:
-            self.bucket.blob(self.path).upload_from_string(
-                b, content_type=self.mimetype
-            )
+            blob = self.bucket.blob(self.path)
+            blob.upload_from_string(b, content_type=self.mimetype)
+            self.set_metadata(blob)
             return
 
+        os.makedirs(Path(self.path).parent, exist_ok=True)
+
         with open(self.path, mode="wb") as w:
             w.write(b)
 
@@ -240,6 +610,9 @@ class GCSPath:
         """Read bytes from the object or file"""
         logger.debug("Read bytes from %s", str(self))
         if self.bucket:
+            if self.download_cache is not None:
+                with self.read_as_file() as r, open(r, mode="rb") as f:
+                    return f.read()
             return self.bucket.blob(self.path).download_as_bytes()
 
         with open(self.path, mode="rb") as r:
@@ -252,7 +625,8 @@ class GCSPath:
         if self.bucket:
             for blob in self.bucket.list_blobs(prefix=self.path):
                 yield GCSPath(
-                    f"gs://{self.bucket.name}/{blob.name}", crc32c=blob.crc32c
+                    f"gs://{self.bucket.name}/{blob.name}",
+                    metadata=ObjectMetadata.from_blob(blob),
                 )
         else:
             for root, _, files in os.walk(self.path):
@@ -265,6 +639,7 @@ class GCSPath:
         if self.bucket:
             logger.debug("Deleting object %s", str(self))
             self.bucket.delete_blob(self.path)
+            self.set_metadata()
         else:
             logger.debug("Deleting file %s", str(self))
             Path(self.path).unlink()
@@ -280,6 +655,13 @@ class GCSPath:
             yield str(self)
             return
 
+        # The cached copy is shared, and must not be modified
+        if self.download_cache is not None:
+            metadata = self.metadata
+            blob = self.bucket.blob(self.path, generation=metadata.generation)
+            yield self.download_cache.fetch(blob, metadata)
+            return
+
         with tempfile.NamedTemporaryFile(suffix=self.suffix) as w:
             logger.debug("Downloading to local file %s", w.name)
             self.bucket.blob(self.path).download_to_filename(w.name)
@@ -299,7 +681,7 @@ class GCSPath:
         # Generate a temporary object
         tmp_obj_name = Path(self.path).name
         tmp_obj = GCSPath(
-            f"{GCS_TMP_PREFIX}/tmp-prefix-{str(uuid.uuid4())}/{tmp_obj_name}"
+            f"{GCS_TMP_PREFIX()}/tmp-prefix-{str(uuid.uuid4())}/{tmp_obj_name}"
         )
 
         # Upload it to GCS
@@ -323,10 +705,12 @@ class GCSPath:
 
         with tempfile.NamedTemporaryFile(suffix=self.suffix) as w:
             yield w.name
-            self.bucket.blob(self.path).upload_from_filename(
+            blob = self.bucket.blob(self.path)
+            blob.upload_from_filename(
                 w.name,
                 content_type=get_mimetype(self.path),
             )
+            self.set_metadata(blob)
 
     # Open for writing as an object
     @contextlib.contextmanager
@@ -342,7 +726,7 @@ class GCSPath:
         # Generate a temporary object
         tmp_obj_name = Path(self.path).name
         tmp_obj = GCSPath(
-            f"{GCS_TMP_PREFIX}/tmp-prefix-{str(uuid.uuid4())}/{tmp_obj_name}"
+            f"{GCS_TMP_PREFIX()}/tmp-prefix-{str(uuid.uuid4())}/{tmp_obj_name}"
         )
 
         # Write as the object
@@ -356,7 +740,7 @@ class GCSPath:
 
     # Open folder for writing (sync'd with GCS)
     @contextlib.contextmanager
-    def write_folder_as_gcs(self) -> Iterator[str]:
+    def write_folder_as_gcs(self, max_workers: Optional[int] = None) -> Iterator[str]:
         """Writable GCS folder that will downloaded if necessary."""
         logger.debug("Writing to %s as GCS folder", str(self))
 
@@ -366,22 +750,17 @@ class GCSPath:
             return
 
         # Generate a temporary prefix
-        tmp_obj = GCSPath(f"{GCS_TMP_PREFIX}/tmp-prefix-{str(uuid.uuid4())}")
+        tmp_obj = GCSPath(f"{GCS_TMP_PREFIX()}/tmp-prefix-{str(uuid.uuid4())}")
 
         # Return temporary GCS directory
         yield str(tmp_obj)
 
-        # Download objects to filesystem
-        for path in tmp_obj.list():
-            # Copy locally
-            path.copy(str(Path(self.path, Path(path.path).relative_to(tmp_obj.path))))
-
-            # Remove the object
-            path.delete()
+        # Download objects to filesystem, removing the objects
+        tmp_obj.download_folder(self.path, max_workers=max_workers, delete=True)
 
     # Open folder for writing (sync'd with GCS)
     @contextlib.contextmanager
-    def write_folder(self) -> Iterator[str]:
+    def write_folder(self, max_workers: Optional[int] = None) -> Iterator[str]:
         """Writable local folder that will uploaded if necessary."""
         logger.debug("Writing to %s as local folder", str(self))
 
@@ -396,14 +775,57 @@ class GCSPath:
             yield d
 
             # Upload objects to GCS
-            for root, _, files in os.walk(d):
-                for file in files:
-                    obj_path = str(Path(self.path, Path(root).relative_to(d), file))
-                    logger.debug("Uploading %s to %s", Path(root, file), obj_path)
-                    self.bucket.blob(obj_path).upload_from_filename(
-                        Path(root, file),
-                        content_type=get_mimetype(obj_path),
-                    )
+            self.upload_folder(d, max_workers=max_workers)
+
+    # Upload a local folder below the GCS prefix
+    def upload_folder(self, local_dir: str, max_workers: Optional[int] = None):
+        """Upload all files in a local folder concurrently (only valid if GCS)"""
+        assert self.bucket, f"Uploading a folder requires a GCS prefix, not {self}"
+
+        file_blob_pairs = []
+        for root, _, files in os.walk(local_dir):
+            for file in files:
+                obj_path = str(Path(self.path, Path(root).relative_to(local_dir), file))
+                logger.debug("Uploading %s to %s", Path(root, file), obj_path)
+                blob = self.bucket.blob(obj_path)
+                blob.content_type = get_mimetype(obj_path)
+                file_blob_pairs.append((str(Path(root, file)), blob))
+
+        if file_blob_pairs:
+            transfer_manager.upload_many(
+                file_blob_pairs,
+                raise_exception=True,
+                worker_type=transfer_manager.THREAD,
+                max_workers=max_workers or self.transfer_workers,
+            )
+
+    # Download all objects below the GCS prefix to a local folder
+    def download_folder(
+        self, local_dir: str, max_workers: Optional[int] = None, delete=False
+    ):
+        """Download all objects concurrently (only valid if GCS), optionally
+        deleting them once downloaded"""
+        assert self.bucket, f"Downloading a folder requires a GCS prefix, not {self}"
+
+        blob_file_pairs = []
+        for blob in self.bucket.list_blobs(prefix=self.path):
+            file = Path(local_dir, Path(blob.name).relative_to(self.path))
+            logger.debug("Downloading %s to %s", blob.name, file)
+            os.makedirs(file.parent, exist_ok=True)
+            blob_file_pairs.append((blob, str(file)))
+
+        if not blob_file_pairs:
+            return
+
+        transfer_manager.download_many(
+            blob_file_pairs,
+            raise_exception=True,
+            worker_type=transfer_manager.THREAD,
+            max_workers=max_workers or self.transfer_workers,
+        )
+
+        if delete:
+            delete_blobs([blob for blob, _ in blob_file_pairs])
 
     def __str__(self) -> str:
         return self.friendly_path
@@ -470,9 +892,7 @@ class GCSPath:
             return self.preset_crc32c
 
         if self.bucket:
-            obj = self.bucket.blob(self.path)
-            obj.reload()
-            return obj.crc32c
+            return self.metadata.crc32c
 
         # Calculate from local filesystem
         from google_crc32c import Checksum  # pylint: disable=import-outside-toplevel
@@ -491,7 +911,5 @@ class GCSPath:
     def size(self) -> int:
         """Return the size (in bytes) of the object or file"""
         if self.bucket:
-            obj = self.bucket.blob(self.path)
-            obj.reload()
-            return obj.size  # pyright: ignore
+            return self.metadata.size
         return os.path.getsize(self.path)
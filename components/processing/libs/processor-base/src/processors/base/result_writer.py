@@ -15,13 +15,16 @@
 
 import functools
 import logging
-from typing import Sequence
+import threading
+from typing import Optional, Sequence
 
 import proto
 from google.api_core.gapic_v1.client_info import ClientInfo
 from google.cloud import bigquery_storage_v1  # type: ignore[import-untyped]
 from google.cloud.bigquery import TableReference
+from google.cloud.bigquery_storage_v1 import exceptions as bqstorage_exceptions  # type: ignore[import-untyped]
 from google.cloud.bigquery_storage_v1 import types  # type: ignore[import-untyped]
+from google.cloud.bigquery_storage_v1 import writer  # type: ignore[import-untyped]
 from google.protobuf import descriptor_pb2
 
 __protobuf__ = proto.module(package="")
@@ -44,37 +47,66 @@ class DocumentMetadata(proto.Message):
     content = proto.Field(Content, number=3)
 
 
-class BigQueryWriter:
-    """BigQueryWriter - using storage API streaming to insert new records"""
+class RowSerializer:
+    """RowSerializer - writer schema and row serialization for a message type
 
-    @staticmethod
-    def get_proto_data(obj: Sequence[proto.Message], with_schema: bool = True):
+    The descriptor is copied into the writer schema once per message type
+    (see get_row_serializer), rather than for every request.
+    """
+
+    def __init__(self, message_type: type[proto.Message]):
+        self.message_type = message_type
+
+        proto_descriptor = descriptor_pb2.DescriptorProto()  # pylint: disable=no-member
+        message_type.pb().DESCRIPTOR.CopyToProto(proto_descriptor)
+        self.schema = types.ProtoSchema(proto_descriptor=proto_descriptor)
+
+    def serialize(self, obj: Sequence[proto.Message]) -> list[bytes]:
+        """Serialize a sequence of messages into rows"""
+        to_pb = self.message_type.pb
+        return [to_pb(o).SerializeToString() for o in obj]
+
+    def get_proto_data(self, obj: Sequence[proto.Message], with_schema: bool = True):
         """Convert a sequence of messages into proto data"""
 
         proto_data = types.AppendRowsRequest.ProtoData()
 
         # Bring in the schema if requested (required first time)
         if with_schema:
-            proto_schema = types.ProtoSchema()
-            proto_descriptor = (
-                descriptor_pb2.DescriptorProto()
-            )  # pylint: disable=no-member
-            type(obj[0]).pb().DESCRIPTOR.CopyToProto(proto_descriptor)
-            proto_schema.proto_descriptor = proto_descriptor
-            proto_data.writer_schema = proto_schema
-
-        # Serialize the rows
-        proto_rows = types.ProtoRows()
-        for o in obj:
-            proto_rows.serialized_rows.append(
-                type(o).serialize(o)
-            )  # pylint: disable=no-member
-
-        proto_data.rows = proto_rows
+            proto_data.writer_schema = self.schema
+
+        proto_data.rows = types.ProtoRows(serialized_rows=self.serialize(obj))
 
         return proto_data
 
-    def __init__(self, table: str):
+
+@functools.cache
+def get_row_serializer(message_type: type[proto.Message]) -> RowSerializer:
+    """Get the (shared) serializer for a message type"""
+    return RowSerializer(message_type)
+
+
+class BigQueryWriter:
+    """BigQueryWriter - using storage API streaming to insert new records
+
+    Rows are buffered and appended over a single append_rows stream, which
+    is opened on the first flush and sends the writer schema only once. The
+    buffer is flushed when it reaches max_rows, max_bytes or has been held for
+    max_latency seconds, and close() must be called to flush the remainder.
+    """
+
+    @staticmethod
+    def get_proto_data(obj: Sequence[proto.Message], with_schema: bool = True):
+        """Convert a sequence of messages into proto data"""
+        return get_row_serializer(type(obj[0])).get_proto_data(obj, with_schema)
+
+    def __init__(
+        self,
+        table: str,
+        max_rows: int = 500,
+        max_bytes: int = 5 * 1024 * 1024,
+        max_latency: float = 10.0,
+    ):
         ref = TableReference.from_string(table)
         self.client = bigquery_storage_v1.BigQueryWriteClient(
             client_info=ClientInfo(
@@ -88,21 +120,137 @@ class BigQueryWriter:
             stream="_default",
         )
 
+        # Flush thresholds (AppendRows requests are limited to 10MB)
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+
+        self.lock = threading.Lock()
+        self.serializer: Optional[RowSerializer] = None
+        self.stream: Optional[writer.AppendRowsStream] = None
+        self.timer: Optional[threading.Timer] = None
+        self.rows: list[bytes] = []
+        self.rows_bytes = 0
+        self.futures: list[writer.AppendRowsFuture] = []
+        self.errors: list[BaseException] = []
+
     def write_results(self, results: Sequence[DocumentMetadata]):
-        """Write some results to the table"""
+        """Write some results to the table (buffered until flushed)"""
 
         if len(results) == 0:
             return
 
-        req = types.AppendRowsRequest()
-        req.write_stream = self.path
-        req.proto_rows = BigQueryWriter.get_proto_data(results)
-
         logger.debug(
-            "Uploading to BigQuery URIs %s",
+            "Buffering for BigQuery URIs %s",
             ", ".join([r.content.uri for r in results]),  # pyright: ignore
         )
-        self.client.append_rows(requests=iter([req]))
+
+        with self.lock:
+            if self.serializer is None:
+                self.serializer = get_row_serializer(type(results[0]))
+
+            rows = self.serializer.serialize(results)
+            self.rows.extend(rows)
+            self.rows_bytes += sum(len(row) for row in rows)
+
+            if len(self.rows) >= self.max_rows or self.rows_bytes >= self.max_bytes:
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.max_latency, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Send the buffered rows to the table"""
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """Flush the buffered rows, wait for all appends and close the stream"""
+        with self.lock:
+            self._flush()
+            for future in self.futures:
+                self._check(future)
+            self.futures = []
+
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+
+            if self.errors:
+                errors, self.errors = self.errors, []
+                raise RuntimeError(
+                    f"{len(errors)} BigQuery appends to {self.path} failed"
+                ) from errors[0]
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if not self.rows:
+            return
+
+        proto_data = types.AppendRowsRequest.ProtoData()
+        proto_data.rows = types.ProtoRows(serialized_rows=self.rows)
+        req = types.AppendRowsRequest()
+        req.proto_rows = proto_data
+
+        logger.debug("Appending %d rows to %s", len(self.rows), self.path)
+        try:
+            future = self._get_stream().send(req)
+        except bqstorage_exceptions.StreamClosedError as e:
+            # Closed since the last append (e.g. by the server), so reopen it
+            # and send the rows again, once
+            logger.warning("Reopening BigQuery append stream to %s: %s", self.path, e)
+            self.stream = None
+            future = self._get_stream().send(req)
+        self.futures.append(future)
+        self.rows = []
+        self.rows_bytes = 0
+
+        # Only keep the appends still awaiting a response
+        pending = []
+        for future in self.futures:
+            if future.done():
+                self._check(future)
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def _get_stream(self) -> writer.AppendRowsStream:
+        # (Re)open the stream, the schema is sent with the first request
+        if self.stream is None:
+            template = types.AppendRowsRequest()
+            template.write_stream = self.path
+            proto_data = types.AppendRowsRequest.ProtoData()
+            proto_data.writer_schema = self.serializer.schema  # pyright: ignore
+            template.proto_rows = proto_data
+            self.stream = writer.AppendRowsStream(self.client, template)
+            self.stream.add_close_callback(self._on_stream_closed)
+        return self.stream
+
+    def _on_stream_closed(self, stream: writer.AppendRowsStream, reason):
+        if reason is not None:
+            logger.warning("BigQuery append stream to %s closed: %s", self.path, reason)
+        # The stream runs the callbacks while holding its own lock, possibly
+        # from a thread holding self.lock (in send or close), so the stream is
+        # forgotten from another thread
+        threading.Thread(
+            target=self._forget_stream, args=(stream,), daemon=True
+        ).start()
+
+    def _forget_stream(self, stream: writer.AppendRowsStream):
+        with self.lock:
+            if self.stream is stream:
+                self.stream = None
+
+    def _check(self, future: writer.AppendRowsFuture):
+        try:
+            future.result()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("BigQuery append to %s failed: %s", self.path, e)
+            self.errors.append(e)
 
 
 @functools.cache
@@ -14,11 +14,21 @@
 
 
 import base64
+import io
+import os
 import unittest
 from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest import mock
 
 from google_crc32c import Checksum
-from processors.base.gcsio import GCS_TMP_PREFIX, GCSPath, get_mimetype
+from processors.base.gcsio import (
+    GCS_TMP_PREFIX,
+    DownloadCache,
+    GCSPath,
+    ObjectMetadata,
+    RangeReader,
+    get_mimetype,
+)
 
 
 class TestGCSIO(unittest.TestCase):
@@ -83,6 +93,35 @@ class TestGCSIO(unittest.TestCase):
         with TemporaryDirectory() as d:
             self.do_obj_test(GCSPath(d, "temp_file"), "tok2")
 
+    def test_metadata(self):
+        test_bytes = bytes("Test bytes metadata", "utf8")
+        folder = GCSPath(GCS_TMP_PREFIX(), "temp_metadata")
+        obj = GCSPath(folder, "file.txt")
+        obj.write_bytes(test_bytes)
+
+        # Fetched once, and matches what is pre-populated from a listing
+        fetched = GCSPath(str(obj))
+        self.assertTrue(fetched.exists())
+        self.assertEqual(fetched.metadata.size, len(test_bytes))
+        self.assertEqual(fetched.metadata.content_type, "text/plain")
+        (listed,) = list(folder.list())
+        self.assertEqual(listed.preset_metadata, fetched.metadata)
+        self.assertEqual(listed.size, fetched.size)
+        self.assertEqual(listed.crc32c, fetched.crc32c)
+
+        # Refreshed when written through the path
+        obj.write_bytes(test_bytes + test_bytes)
+        self.assertEqual(obj.size, 2 * len(test_bytes))
+
+        # Existence is checked again, even with the metadata cached, and
+        # refreshes it
+        self.assertTrue(fetched.exists())
+        self.assertEqual(fetched.size, 2 * len(test_bytes))
+        obj.delete()
+        self.assertFalse(obj.exists())
+        self.assertFalse(fetched.exists())
+        self.assertFalse(listed.exists())
+
     def do_pair_test(self, src, dst, token):
         test_bytes = bytes(f"Test bytes {token}", "utf8")
 
@@ -229,3 +268,167 @@ class TestGCSIO(unittest.TestCase):
 
             with open(f.name, "rt") as ft:
                 self.assertTrue(ft.read(), content)
+
+
+class FakeBlob:
+    """Stands in for a storage.Blob, counting the downloads (and recording
+    the ranges downloaded)"""
+
+    def __init__(self, data: bytes):
+        self.name = "fake"
+        self.data = data
+        self.downloads = 0
+        self.ranges: list[tuple[int, int]] = []
+
+    def download_to_file(self, f):
+        self.downloads += 1
+        f.write(self.data)
+
+    def download_as_bytes(self, start: int, end: int, checksum=None):
+        self.ranges.append((start, end))
+        return self.data[start : end + 1]
+
+    @property
+    def metadata(self) -> ObjectMetadata:
+        c = Checksum()
+        c.update(self.data)
+        return ObjectMetadata(
+            size=len(self.data), crc32c=str(base64.b64encode(c.digest()), "utf8")
+        )
+
+
+class TestDownloadCache(unittest.TestCase):
+
+    def test_key(self):
+        with TemporaryDirectory() as d:
+            cache = DownloadCache(d, max_bytes=1000)
+            blob = FakeBlob(b"Test cache key")
+            metadata = blob.metadata
+
+            # Keyed by the crc32c (in hex) and the size
+            path = cache.fetch(blob, metadata)
+            key = base64.b64decode(metadata.crc32c).hex()
+            self.assertEqual(os.path.basename(path), f"{key}-{metadata.size}")
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), blob.data)
+
+            # The same content from another object is not downloaded again
+            other = FakeBlob(blob.data)
+            self.assertEqual(cache.fetch(other, other.metadata), path)
+            self.assertEqual((blob.downloads, other.downloads), (1, 0))
+
+            # A different size is a different entry, even with the same crc32c
+            resized = ObjectMetadata(size=metadata.size + 1, crc32c=metadata.crc32c)
+            self.assertIsNone(cache.get(resized))
+            self.assertNotEqual(cache.cached_path(resized), path)
+
+            self.assertEqual(
+                cache.stats(),
+                dict(hits=1, misses=2, evictions=0, bytes=len(blob.data)),
+            )
+
+    def test_eviction(self):
+        with TemporaryDirectory() as d:
+            cache = DownloadCache(d, max_bytes=25)
+            blobs = [FakeBlob(bytes(f"Test evict{i}", "utf8")) for i in range(3)]
+            paths = [cache.fetch(b, b.metadata) for b in blobs[:2]]
+            self.assertEqual(cache.evictions, 0)
+
+            # The first is older, but is used again so the second is evicted
+            os.utime(paths[0], (1, 1))
+            os.utime(paths[1], (2, 2))
+            self.assertEqual(cache.get(blobs[0].metadata), paths[0])
+            paths.append(cache.fetch(blobs[2], blobs[2].metadata))
+
+            self.assertTrue(os.path.exists(paths[0]))
+            self.assertFalse(os.path.exists(paths[1]))
+            self.assertTrue(os.path.exists(paths[2]))
+            self.assertEqual(cache.evictions, 1)
+            self.assertEqual(cache.stats()["bytes"], 2 * len(blobs[0].data))
+
+            # The object just fetched is kept, even if alone over the cap
+            cache.max_bytes = 5
+            big = FakeBlob(b"Test evict the rest")
+            path = cache.fetch(big, big.metadata)
+            self.assertEqual([e.path for e in cache.entries()], [path])
+            self.assertEqual(cache.evictions, 3)
+
+    def test_counters(self):
+        with TemporaryDirectory() as d:
+            cache = DownloadCache(d, max_bytes=1000)
+            cache.add_counters(dict(hits=2, misses=3))
+            cache.add_counters(dict(hits=1, misses=1, evictions=4))
+            self.assertEqual(cache.counters(), dict(hits=3, misses=4, evictions=4))
+
+
+class TestRangeReader(unittest.TestCase):
+
+    def setUp(self):
+        self.data = bytes(range(256)) * 4
+        self.blob = FakeBlob(self.data)
+        # Blocks of 100 bytes, caching up to 4 blocks
+        self.reader = RangeReader(
+            self.blob, len(self.data), block_size=100, cache_blocks=4, max_read_ahead=4
+        )
+
+    def test_seek_read(self):
+        reader = self.reader
+        # Across block boundaries
+        reader.seek(95)
+        self.assertEqual(reader.read(110), self.data[95:205])
+        self.assertEqual(reader.tell(), 205)
+        reader.seek(-10, io.SEEK_CUR)
+        self.assertEqual(reader.read(20), self.data[195:215])
+        # Up to the end only
+        reader.seek(-5, io.SEEK_END)
+        self.assertEqual(reader.read(10), self.data[-5:])
+        self.assertEqual(reader.read(10), b"")
+        with self.assertRaises(ValueError):
+            reader.seek(-1)
+
+    def test_read_ahead(self):
+        # Sequential reads double the blocks per request, up to the maximum
+        while self.reader.read(50):
+            pass
+        self.assertEqual(
+            self.blob.ranges, [(0, 199), (200, 599), (600, 999), (1000, 1023)]
+        )
+        self.assertEqual(self.reader.requests, 4)
+        self.assertEqual(self.reader.bytes_fetched, len(self.data))
+
+        # A seek elsewhere resets the read-ahead to one block
+        self.reader.seek(150)
+        self.reader.read(10)
+        self.assertEqual(self.blob.ranges[-1], (100, 199))
+
+    def test_read_ahead_cached(self):
+        # The read-ahead stops at the next block already cached
+        for position in (250, 50, 150):
+            self.reader.seek(position)
+            self.reader.read(10)
+        self.assertEqual(self.blob.ranges, [(200, 299), (0, 99), (100, 199)])
+
+    def test_eviction(self):
+        while self.reader.read(50):
+            pass
+        self.assertEqual(list(self.reader.blocks), [7, 8, 9, 10])
+
+        # The least recently used block is evicted, not the first fetched
+        hits = self.reader.hits
+        for position in (150, 950, 350):
+            self.reader.seek(position)
+            self.reader.read(10)
+        self.assertEqual(list(self.reader.blocks), [10, 1, 9, 3])
+        self.assertEqual(self.reader.hits - hits, 1)
+
+    def test_generation(self):
+        # Range requests are pinned to the generation of the metadata
+        bucket = mock.Mock()
+        bucket.blob.return_value = self.blob
+        metadata = ObjectMetadata(size=len(self.data), crc32c="", generation=42)
+        with mock.patch.object(GCSPath, "open_bucket", return_value=bucket):
+            path = GCSPath("gs://bucket/object", metadata=metadata)
+            with path.open_random_access(block_size=100) as f:
+                f.seek(300)
+                self.assertEqual(f.read(10), self.data[300:310])
+        bucket.blob.assert_called_once_with("object", generation=42)
@@ -0,0 +1,166 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+from typing import Optional
+from unittest import mock
+
+from google.cloud.bigquery_storage_v1 import exceptions as bqstorage_exceptions  # type: ignore[import-untyped]
+from processors.base import result_writer
+from processors.base.result_writer import BigQueryWriter, DocumentMetadata
+
+
+class FakeFuture:
+    """Stands in for an AppendRowsFuture, already resolved"""
+
+    def __init__(self, error: Optional[Exception] = None):
+        self.error = error
+
+    def done(self):
+        return True
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+
+
+class FakeStream:
+    """Stands in for an AppendRowsStream, recording the rows of each send
+
+    Sends raise the errors queued in send_errors, and resolve to the errors
+    queued in append_errors.
+    """
+
+    def __init__(self, test: "TestBigQueryWriter", template):
+        self.test = test
+        self.has_schema = bool(template.proto_rows.writer_schema.proto_descriptor.name)
+        self.sent: list[int] = []
+        self.closed = False
+        self.callbacks: list = []
+        test.streams.append(self)
+
+    def add_close_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def send(self, req):
+        if self.test.send_errors:
+            raise self.test.send_errors.pop(0)
+        self.sent.append(len(req.proto_rows.rows.serialized_rows))
+        self.test.sent.set()
+        error = self.test.append_errors.pop(0) if self.test.append_errors else None
+        return FakeFuture(error)
+
+    def close(self, reason=None):
+        if not self.closed:
+            self.closed = True
+            for callback in self.callbacks:
+                callback(self, reason)
+
+
+class TestBigQueryWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.streams: list[FakeStream] = []
+        self.send_errors: list[Exception] = []
+        self.append_errors: list[Exception] = []
+        self.sent = threading.Event()
+
+        client = mock.patch.object(
+            result_writer.bigquery_storage_v1, "BigQueryWriteClient"
+        ).start()
+        client.return_value.write_stream_path.return_value = (
+            "projects/p/datasets/d/tables/t/streams/_default"
+        )
+        mock.patch.object(
+            result_writer.writer,
+            "AppendRowsStream",
+            lambda _, template: FakeStream(self, template),
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def docs(self, count: int, size: int = 10) -> list[DocumentMetadata]:
+        return [
+            DocumentMetadata(
+                id=str(i),
+                jsonData="x" * size,
+                content=DocumentMetadata.Content(uri=f"gs://b/{i}.txt"),
+            )
+            for i in range(count)
+        ]
+
+    def test_max_rows(self):
+        writer = BigQueryWriter("p.d.t", max_rows=3, max_latency=60)
+        writer.write_results(self.docs(2))
+        self.assertEqual(self.streams, [])
+        writer.write_results(self.docs(2))
+        writer.write_results(self.docs(1))
+        # Opened once, with the schema sent in the first request
+        self.assertEqual(len(self.streams), 1)
+        self.assertTrue(self.streams[0].has_schema)
+        self.assertEqual(self.streams[0].sent, [4])
+
+        writer.close()
+        self.assertEqual(self.streams[0].sent, [4, 1])
+        self.assertTrue(self.streams[0].closed)
+
+    def test_max_bytes(self):
+        writer = BigQueryWriter("p.d.t", max_bytes=1000, max_latency=60)
+        writer.write_results(self.docs(1, size=500))
+        self.assertEqual(self.streams, [])
+        writer.write_results(self.docs(1, size=500))
+        self.assertEqual(self.streams[0].sent, [2])
+        writer.close()
+
+    def test_max_latency(self):
+        writer = BigQueryWriter("p.d.t", max_latency=0.01)
+        writer.write_results(self.docs(1))
+        self.assertTrue(self.sent.wait(5))
+        self.assertEqual(self.streams[0].sent, [1])
+        self.assertIsNone(writer.timer)
+        writer.close()
+        self.assertEqual(self.streams[0].sent, [1])
+
+    def test_reopen(self):
+        writer = BigQueryWriter("p.d.t", max_rows=1)
+        writer.write_results(self.docs(1))
+
+        # Closed since the last append, the rows are sent on a new stream
+        self.send_errors.append(bqstorage_exceptions.StreamClosedError("closed"))
+        with self.assertLogs(level="WARNING"):
+            writer.write_results(self.docs(1))
+        self.assertEqual(len(self.streams), 2)
+        self.assertTrue(self.streams[1].has_schema)
+        self.assertEqual(self.streams[1].sent, [1])
+
+        # Only once
+        self.send_errors.extend([bqstorage_exceptions.StreamClosedError("closed")] * 2)
+        with self.assertLogs(level="WARNING"):
+            with self.assertRaises(bqstorage_exceptions.StreamClosedError):
+                writer.write_results(self.docs(1))
+        self.assertEqual(len(self.streams), 3)
+
+    def test_close_after_failed_append(self):
+        writer = BigQueryWriter("p.d.t", max_rows=1)
+        self.append_errors.append(RuntimeError("append failed"))
+        with self.assertLogs(level="ERROR"):
+            writer.write_results(self.docs(1))
+        writer.write_results(self.docs(1))
+
+        with self.assertRaises(RuntimeError) as cm:
+            writer.close()
+        self.assertIn("1 BigQuery appends", str(cm.exception))
+        self.assertEqual(str(cm.exception.__cause__), "append failed")
+        # Reported once
+        writer.close()
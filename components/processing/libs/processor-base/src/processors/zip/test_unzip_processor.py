@@ -0,0 +1,101 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+import zipfile
+from tempfile import TemporaryDirectory
+
+from processors.base.gcsio import GCSPath
+from processors.zip.unzip_processor import (
+    MAX_NESTING_DEPTH,
+    ExpansionBudget,
+    member_path,
+    unzip_processor,
+)
+
+
+class TestUnzipProcessor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_zip(self, name: str, members: list[tuple[str, str]]) -> GCSPath:
+        path = os.path.join(self.dir, name)
+        with zipfile.ZipFile(path, "w") as z:
+            for member_name, data in members:
+                z.writestr(member_name, data)
+        return GCSPath(path)
+
+    def test_member_path(self):
+        self.assertEqual(member_path("a/b.txt"), "a/b.txt")
+        self.assertEqual(member_path("../../a\\b.txt"), "a/b.txt")
+        self.assertEqual(member_path("/a/./b.txt"), "a/b.txt")
+        self.assertIsNone(member_path("../"))
+
+    def test_unzip(self):
+        source = self.make_zip(
+            "a.zip", [("x/doc.txt", "doc"), ("x/bin.exe", "MZ"), ("../up.txt", "up")]
+        )
+        output = GCSPath(self.dir, "a.zip.out")
+        metadata = unzip_processor(
+            source, output, include=lambda name: name.endswith(".txt")
+        )
+        self.assertEqual(metadata, {"skipped": ["x/bin.exe"]})
+        self.assertEqual(GCSPath(output, "x/doc.txt").read_text(), "doc")
+        self.assertEqual(GCSPath(output, "up.txt").read_text(), "up")
+        self.assertFalse(GCSPath(output, "x/bin.exe").exists())
+
+    def test_colliding_paths(self):
+        # Only the last of the members sanitized to the same path is expanded
+        source = self.make_zip(
+            "a.zip", [("doc.txt", "first"), ("../doc.txt", "last"), ("b.txt", "b")]
+        )
+        output = GCSPath(self.dir, "a.zip.out")
+        budget = ExpansionBudget()
+        with self.assertLogs(level="WARNING"):
+            unzip_processor(source, output, budget=budget)
+        self.assertEqual(GCSPath(output, "doc.txt").read_text(), "last")
+        self.assertEqual(budget.members, ExpansionBudget().members - 2)
+
+    def test_shared_budget(self):
+        first = self.make_zip("a.zip", [("a.txt", "a" * 100), ("b.txt", "b")])
+        second = self.make_zip("b.zip", [("c.txt", "c" * 100)])
+        budget = ExpansionBudget()
+        budget.members = 3
+        budget.size = 150
+
+        unzip_processor(first, GCSPath(self.dir, "a.zip.out"), budget=budget)
+        self.assertEqual((budget.members, budget.size), (1, 49))
+
+        # Over the bytes left, nothing is expanded
+        with self.assertRaisesRegex(ValueError, "bytes"):
+            unzip_processor(second, GCSPath(self.dir, "b.zip.out"), budget=budget)
+        self.assertFalse(GCSPath(self.dir, "b.zip.out/c.txt").exists())
+
+        budget.size = 1000
+        with self.assertRaisesRegex(ValueError, "members"):
+            unzip_processor(first, GCSPath(self.dir, "c.zip.out"), budget=budget)
+
+    def test_nesting_depth(self):
+        source = self.make_zip("a.zip", [("a.txt", "a")])
+        unzip_processor(source, GCSPath(self.dir, "a.out"), depth=MAX_NESTING_DEPTH)
+        with self.assertRaisesRegex(ValueError, "nested"):
+            unzip_processor(
+                source, GCSPath(self.dir, "b.out"), depth=MAX_NESTING_DEPTH + 1
+            )
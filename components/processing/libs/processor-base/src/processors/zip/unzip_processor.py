@@ -13,8 +13,11 @@
 # limitations under the License.
 
 import logging
+import shutil
 import zipfile
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+from typing import Callable, Dict, Optional
 
 from processors.base.gcsio import GCSPath
 
@@ -23,16 +26,126 @@ from processors.base.gcsio import GCSPath
 
 logger = logging.getLogger(__name__)
 
+# Limits on an archive, along with the archives nested in it, checked from
+# each central directory before expanding
+MAX_MEMBERS = 10000
+MAX_UNCOMPRESSED_SIZE = 4 * 1024 * 1024 * 1024
 
-def unzip_processor(source: GCSPath, output_dir: GCSPath) -> Dict:
-    # Unzip the zip archive
+# Maximum number of archives an expanded archive can be nested in
+MAX_NESTING_DEPTH = 3
+
+# Members up to this size are uploaded in one request, larger ones streamed
+MAX_SINGLE_UPLOAD_SIZE = 8 * 1024 * 1024
+
+
+def member_path(name: str) -> Optional[str]:
+    """Relative output path for a member, sanitized as zipfile.extract does"""
+    parts = [
+        p for p in PurePosixPath(name.replace("\\", "/")).parts if p not in ("/", "..")
+    ]
+    return "/".join(parts) if parts else None
+
+
+class ExpansionBudget:
+    """Members and bytes left to expand from a top-level archive, shared by
+    the archives nested in it"""
+
+    def __init__(self):
+        self.members = MAX_MEMBERS
+        self.size = MAX_UNCOMPRESSED_SIZE
+
+    def spend(self, source: GCSPath, members: list[zipfile.ZipInfo]):
+        """Fail before expanding anything if the archive is over the budget"""
+        if len(members) > self.members:
+            raise ValueError(
+                f"{source} has {len(members)} members, exceeding the "
+                f"{self.members} left of the limit of {MAX_MEMBERS}"
+            )
+
+        total_size = sum(m.file_size for m in members)
+        if total_size > self.size:
+            raise ValueError(
+                f"{source} expands to {total_size} bytes, exceeding the "
+                f"{self.size} left of the limit of {MAX_UNCOMPRESSED_SIZE} bytes"
+            )
+
+        self.members -= len(members)
+        self.size -= total_size
+
+
+def expand_member(z: zipfile.ZipFile, member: zipfile.ZipInfo, output: GCSPath):
+    """Decompress a member straight into its output object or file"""
+    logger.debug(f"Expanding {member.filename} to {output}")
+    if member.file_size <= MAX_SINGLE_UPLOAD_SIZE:
+        output.write_bytes(z.read(member))
+        return
+
+    with z.open(member) as r, output.open("wb") as w:
+        shutil.copyfileobj(r, w, MAX_SINGLE_UPLOAD_SIZE)
+
+
+def unzip_processor(
+    source: GCSPath,
+    output_dir: GCSPath,
+    include: Optional[Callable[[str], bool]] = None,
+    budget: Optional[ExpansionBudget] = None,
+    depth: int = 0,
+) -> Dict:
+    """Expand the members of a zip archive into the output folder
+
+    Only the byte ranges of the archive that are needed are read, so the
+    members not matching `include` (if given) are never fetched. These are
+    returned in the metadata as skipped.
+
+    An archive nested in `depth` other archives spends from the budget of
+    the top-level archive, so the limits hold for the whole expansion.
+    """
     logger.info(f"Unzipping {str(source)}")
+    if depth > MAX_NESTING_DEPTH:
+        raise ValueError(
+            f"{source} is nested in {depth} archives, exceeding the limit of "
+            f"{MAX_NESTING_DEPTH}"
+        )
+    if budget is None:
+        budget = ExpansionBudget()
+
+    skipped = []
     with (
-        source.read_as_file() as r,
+        source.open_random_access() as r,
         zipfile.ZipFile(r) as z,
-        output_dir.write_folder() as output,
     ):
-        z.extractall(output)
+        members: Dict[str, zipfile.ZipInfo] = {}
+        for member in z.infolist():
+            if member.is_dir():
+                continue
+            if include is not None and not include(member.filename):
+                skipped.append(member.filename)
+                continue
+            path = member_path(member.filename)
+            if path is None:
+                continue
+            # Members sanitized to the same path would be written at the same
+            # time, so only the last one is expanded (as zipfile looks names up)
+            if path in members:
+                logger.warning(
+                    f"Not expanding {members[path].filename} of {source}, as "
+                    f"{member.filename} is also expanded to {path}"
+                )
+            members[path] = member
+        budget.spend(source, list(members.values()))
+
+        # Members are decompressed and uploaded concurrently (reads of a
+        # ZipFile are safe across threads)
+        with ThreadPoolExecutor(max_workers=GCSPath.transfer_workers) as pool:
+            futures = []
+            for path, member in members.items():
+                futures.append(
+                    pool.submit(expand_member, z, member, GCSPath(output_dir, path))
+                )
+            for future in futures:
+                future.result()
 
     # Add it in as a rendered type
+    if skipped:
+        return {"skipped": skipped}
     return dict()
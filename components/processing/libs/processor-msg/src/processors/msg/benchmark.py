@@ -0,0 +1,123 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse
+import logging
+import tempfile
+import time
+import uuid
+
+from dotenv import load_dotenv
+from processors.base.gcsio import GCSPath
+from processors.msg.main_processor import Executors, Processors, process_all_objects
+from processors.msg.msg_generator import MSGGenerator
+
+SUPPORTED_FILES = {
+    ".msg": Processors.MSG.value,
+    ".xlsx": Processors.XLSX.value,
+    ".txt": Processors.TXT.value,
+    ".zip": Processors.ZIP.value,
+}
+
+
+def generate_corpus(corpus_dir: GCSPath, count: int):
+    generator = MSGGenerator()
+    for i in range(count):
+        generator.save(GCSPath(corpus_dir, f"bench-{i:08d}.msg"))
+
+
+def run_once(corpus_dir: GCSPath, run_dir: GCSPath, workers: int, executor: str):
+    # Fresh copy of the corpus, as processing writes outputs alongside it
+    for obj in corpus_dir.list():
+        obj.copy(GCSPath(run_dir, "input", obj.name))
+
+    start = time.perf_counter()
+    process_all_objects(
+        GCSPath(run_dir, "input"),
+        GCSPath(run_dir, "reject"),
+        SUPPORTED_FILES,
+        write_json=True,
+        workers=workers,
+        executor=executor,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(
+        prog="msg_benchmark",
+        description="Benchmark process_all_objects on a generated .msg corpus",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--work_dir",
+        default=tempfile.gettempdir(),
+        type=str,
+        help="Folder (local or GCS) for the corpus and the benchmark runs",
+    )
+    parser.add_argument(
+        "--count", type=int, default=20, help="Count of .msg files to generate"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[2, 4, 8],
+        help="Worker counts to compare against the serial loop",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=[x.value for x in Executors],
+        nargs="+",
+        default=[x.value for x in Executors],
+        help="Executors to benchmark",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    bench_dir = GCSPath(args.work_dir, f"msg-benchmark-{uuid.uuid4()}")
+    corpus_dir = GCSPath(bench_dir, "corpus")
+    print(f"Generating {args.count} .msg files in {corpus_dir}")
+    generate_corpus(corpus_dir, args.count)
+
+    runs = [("serial", 1)]
+    runs.extend(
+        (executor, workers) for executor in args.executor for workers in args.workers
+    )
+
+    baseline = None
+    print(
+        f"{'executor':>10} {'workers':>8} {'seconds':>10} {'objs/s':>8} {'speedup':>8}"
+    )
+    for executor, workers in runs:
+        run_dir = GCSPath(bench_dir, f"run-{executor}-{workers}")
+        elapsed = run_once(
+            corpus_dir,
+            run_dir,
+            workers,
+            Executors.THREAD.value if executor == "serial" else executor,
+        )
+        baseline = baseline or elapsed
+        print(
+            f"{executor:>10} {workers:>8} {elapsed:>10.2f} "
+            f"{args.count / elapsed:>8.2f} {baseline / elapsed:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
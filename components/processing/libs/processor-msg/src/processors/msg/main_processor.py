@@ -13,16 +13,33 @@
 # limitations under the License.
 
 
+import functools
 import json
 import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from enum import Enum
-from typing import Dict, Optional
+from pathlib import Path
+from typing import Dict, Iterator, Optional
 
-from processors.base.gcsio import GCSPath
+from processors.base.gcsio import DownloadCache, GCSPath, ObjectMetadata
 from processors.base.result_writer import BigQueryWriter, DocumentMetadata
 from processors.msg.msg_processor import msg_processor
 from processors.xlsx import xlsx_processor
-from processors.zip.unzip_processor import unzip_processor
+from processors.zip.unzip_processor import (
+    ExpansionBudget,
+    member_path,
+    unzip_processor,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +51,11 @@ class Processors(str, Enum):
     XLSX = "xlsx-processor"
 
 
+class Executors(str, Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+
 PROCESSOR_NAMES_TO_CALLABLE = {
     Processors.TXT.value: None,  # Special case - handled inline within code
     Processors.MSG.value: msg_processor,
@@ -48,21 +70,199 @@ def process_all_objects(
     supported_files: Dict[str, str],
     write_json=True,
     write_bigquery: str = "",
+    workers: int = 1,
+    executor: str = Executors.THREAD.value,
+    queue_depth: Optional[int] = None,
 ):
-    all_objects = list(source_dir.list())
+    all_objects = list_source_objects(source_dir)
 
     writer = None
     if write_bigquery != "":
         writer = BigQueryWriter(write_bigquery)
 
-    for obj in all_objects:
-        process_object(
-            obj,
+    try:
+        process_objects(
+            all_objects,
             reject_dir,
             supported_files,
             write_json=write_json,
             bq_writer=writer,
+            workers=workers,
+            executor=executor,
+            queue_depth=queue_depth,
+        )
+    except BaseException:
+        # Still flush the results of the objects processed, without hiding
+        # the error that stopped the processing
+        if writer:
+            try:
+                writer.close()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception(f"Failed to flush results to {write_bigquery}")
+        raise
+
+    # Flush the results still buffered for BigQuery
+    if writer:
+        writer.close()
+
+
+def process_objects(
+    all_objects: Iterator[GCSPath],
+    reject_dir: GCSPath,
+    supported_files: Dict[str, str],
+    write_json=True,
+    bq_writer: Optional[BigQueryWriter] = None,
+    workers: int = 1,
+    executor: str = Executors.THREAD.value,
+    queue_depth: Optional[int] = None,
+):
+    # Serial processing, one object at a time
+    if workers <= 1:
+        for obj in all_objects:
+            process_object(
+                obj,
+                reject_dir,
+                supported_files,
+                write_json=write_json,
+                bq_writer=bq_writer,
+            )
+        return
+
+    # Bound the objects in flight, so listing only runs ahead of the
+    # workers by queue_depth objects
+    if not queue_depth:
+        queue_depth = 2 * workers
+
+    logger.info(f"Processing objects with {workers} {executor} workers")
+
+    def complete(futures):
+        for future in futures:
+            result = future.result()
+            # Extraction ran in a worker process, results are written
+            # from this process
+            if executor == Executors.PROCESS.value:
+                objs, cache_counters = result
+                if GCSPath.download_cache and cache_counters:
+                    GCSPath.download_cache.add_counters(cache_counters)
+                write_object_results(objs, write_json=write_json, bq_writer=bq_writer)
+
+    with get_executor(executor, workers) as pool:
+        pending: set[Future] = set()
+        for obj in all_objects:
+            if len(pending) >= queue_depth:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                complete(done)
+
+            if executor == Executors.PROCESS.value:
+                future = pool.submit(
+                    extract_object,
+                    str(obj),
+                    obj.preset_metadata,
+                    str(reject_dir),
+                    supported_files,
+                )
+            else:
+                future = pool.submit(
+                    process_object,
+                    obj,
+                    reject_dir,
+                    supported_files,
+                    write_json=write_json,
+                    bq_writer=bq_writer,
+                )
+            pending.add(future)
+
+        complete(as_completed(pending))
+
+
+def list_source_objects(source_dir: GCSPath) -> Iterator[GCSPath]:
+    """Stream the objects below a folder or prefix to process
+
+    Processing writes outputs (.out folders and .json metadata) next to each
+    source, so objects generated by an object already yielded are skipped
+    rather than picked up by the listing still in progress.
+    """
+    yielded: set[str] = set()
+    # GCS lists in lexicographic order, so once the listing is past the
+    # range of paths an object can generate, it can be forgotten
+    in_order: Optional[deque[str]] = deque() if source_dir.is_gcs() else None
+
+    for obj in source_dir.list():
+        if in_order is not None:
+            while in_order and obj.path >= in_order[0] + "/":
+                yielded.discard(in_order.popleft())
+
+        if is_generated_output(obj.path, yielded):
+            logger.debug(f"Skipping generated output {obj}")
+            continue
+
+        yielded.add(obj.path)
+        if in_order is not None:
+            in_order.append(obj.path)
+        yield obj
+
+
+def is_generated_output(path: str, sources: set[str]) -> bool:
+    """Return if the path is an output written when processing one of sources"""
+    if path.endswith(".json") and path[: -len(".json")] in sources:
+        return True
+
+    idx = path.find(".out/")
+    while idx != -1:
+        if path[:idx] in sources:
+            return True
+        idx = path.find(".out/", idx + 1)
+    return False
+
+
+def get_executor(executor: str, workers: int) -> Executor:
+    if executor == Executors.THREAD.value:
+        return ThreadPoolExecutor(max_workers=workers)
+    if executor == Executors.PROCESS.value:
+        # Spawn rather than fork, as the GCS and BigQuery clients are not
+        # safe to share with a forked child
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(
+                logging.getLogger().level,
+                GCSPath.transfer_workers,
+                GCSPath.download_cache,
+            ),
         )
+    raise ValueError(f"Unknown executor {executor}")
+
+
+def init_worker(
+    log_level: int,
+    transfer_workers: int,
+    download_cache: Optional[DownloadCache],
+):
+    logging.basicConfig(level=log_level)
+    GCSPath.transfer_workers = transfer_workers
+    GCSPath.download_cache = download_cache
+
+
+def extract_object(
+    source: str,
+    metadata: Optional[ObjectMetadata],
+    reject_dir: str,
+    supported_files: Dict[str, str],
+) -> tuple[list[dict], dict]:
+    """Run the processors for an object within a worker process
+
+    Returns the results along with the download cache counters for this
+    object, as the counters of the worker are not seen by the parent.
+    """
+    logger.info(f"Processing {source}...")
+    cache = GCSPath.download_cache
+    before = cache.counters() if cache else {}
+    objs = process_recursive(
+        GCSPath(source, metadata=metadata), GCSPath(reject_dir), supported_files
+    )
+    after = cache.counters() if cache else {}
+    return objs, {k: after[k] - before[k] for k in after}
 
 
 def move_rejected_file(source: GCSPath, reject_dir: GCSPath, error_msg: str):
@@ -102,11 +302,20 @@ def process_recursive(
     source: GCSPath,
     reject_dir: GCSPath,
     supported_files: Dict[str, str],
+    budget: Optional[ExpansionBudget] = None,
+    depth: int = 0,
 ) -> list[dict]:
+    """Process an object, and the objects expanded from it
+
+    Archives nested in `depth` other archives share the expansion budget of
+    the top-level archive.
+    """
 
     result = {
         "objid": "",
         "uri": str(source),
+        # Recorded for the document registry, for indexed objects only
+        "crc32c": None,
         "mimetype": source.mimetype,
         "metadata": {},
         "status": "UNPROCESSED",
@@ -132,6 +341,8 @@ def process_recursive(
             return results
 
         result["objid"] = source.hash
+        # Already read for the hash (from the listing metadata, for objects)
+        result["crc32c"] = source.crc32c
         result["status"] = "Indexed"
         return results
 
@@ -148,6 +359,19 @@ def process_recursive(
         )
         return results
 
+    # Archive members that could not be processed are not expanded at all
+    child_depth = depth
+    if processor_name == Processors.ZIP.value:
+        if budget is None:
+            budget = ExpansionBudget()
+        child_depth = depth + 1
+        processor = functools.partial(
+            processor,
+            include=lambda name: bool(supported_files.get(Path(name).suffix, False)),
+            budget=budget,
+            depth=depth,
+        )
+
     # Attempt to use it.
     output = GCSPath(str(source) + ".out")
     if output.exists():
@@ -163,6 +387,8 @@ def process_recursive(
             return results
 
         result["status"] = "Expanded"
+        # Archive members that were not expanded are reported as children
+        skipped = metadata.pop("skipped", [])
         result["metadata"] = metadata
 
     except Exception as e:
@@ -175,8 +401,30 @@ def process_recursive(
         return results
 
     # Return with the children
-    for child in list(output.list()):
-        results.extend(process_recursive(child, reject_dir, supported_files))
+    for child in list_source_objects(output):
+        results.extend(
+            process_recursive(
+                child, reject_dir, supported_files, budget=budget, depth=child_depth
+            )
+        )
+
+    for name in skipped:
+        path = member_path(name)
+        if path is None:
+            continue
+        child = GCSPath(output, path)
+        results.append(
+            {
+                "objid": "",
+                "uri": str(child),
+                "crc32c": None,
+                "mimetype": child.mimetype,
+                "metadata": {
+                    "reason": f"file of type {child.suffix} not " f"supported"
+                },
+                "status": "Not indexed or expanded",
+            }
+        )
 
     return results
 
@@ -194,10 +442,19 @@ def process_object(
     # Extract everything
     objs = process_recursive(source, reject_dir, supported_files)
 
+    write_object_results(objs, write_json=write_json, bq_writer=bq_writer)
+
+
+def write_object_results(
+    objs: list[dict],
+    write_json=True,
+    bq_writer: Optional[BigQueryWriter] = None,
+):
+
     logger.debug(f"Objects: {objs}")
 
     # Create a object map with a subset of the data
-    obj_keys = ["uri", "objid", "status", "mimetype"]
+    obj_keys = ["uri", "objid", "status", "mimetype", "crc32c"]
     obj_map = []
     for obj in objs:
         obj_map.append(dict(((k, obj[k]) for k in obj_keys)))
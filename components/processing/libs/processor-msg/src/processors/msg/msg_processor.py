@@ -48,7 +48,7 @@ def msg_processor(
 
     # Generate generic output
     with (
-        source.read_as_file() as r,
+        source.open_random_access() as r,
         openMsg(r, errorBehavior=error_behavior) as msg,
         output_dir.write_folder() as output,
     ):
@@ -16,8 +16,8 @@
 import argparse
 import logging
 
-from processors.base.gcsio import GCSPath
-from processors.msg.main_processor import Processors, process_all_objects
+from processors.base.gcsio import DownloadCache, GCSPath
+from processors.msg.main_processor import Executors, Processors, process_all_objects
 
 
 # Specialized action to parse multiple key-value pairs into a dict
@@ -62,6 +62,45 @@ def main() -> None:
         default="",
         help="BigQuery fully qualified table to write results",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of objects to process concurrently (1 processes serially)",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=[x.value for x in Executors],
+        default=Executors.THREAD.value,
+        help="Use a thread pool (I/O-bound) or a process pool (CPU-bound) "
+        "when processing with more than one worker",
+    )
+    parser.add_argument(
+        "--queue-depth",
+        type=int,
+        default=None,
+        help="Maximum objects listed ahead of the workers (default twice the "
+        "number of workers)",
+    )
+    parser.add_argument(
+        "--transfer-workers",
+        type=int,
+        default=GCSPath.transfer_workers,
+        help="Number of concurrent uploads/downloads when staging folders",
+    )
+    parser.add_argument(
+        "--download-cache",
+        type=str,
+        default=None,
+        help="Local folder caching downloaded objects by content, so re-runs "
+        "over the same objects skip their downloads",
+    )
+    parser.add_argument(
+        "--download-cache-size",
+        type=int,
+        default=1024,
+        help="Maximum size of the download cache in MB",
+    )
     all_processors = ", ".join([x.value for x in Processors])
     parser.add_argument(
         "--file-type",
@@ -80,6 +119,12 @@ def main() -> None:
 
     logging.basicConfig(level=logging.getLevelName(args.logLevel))
 
+    GCSPath.transfer_workers = args.transfer_workers
+    if args.download_cache:
+        GCSPath.download_cache = DownloadCache(
+            args.download_cache, args.download_cache_size * 1024 * 1024
+        )
+
     # Process everything
     process_all_objects(
         GCSPath(args.process_dir),
@@ -87,8 +132,14 @@ def main() -> None:
         args.supported_files,
         write_json=args.write_json,
         write_bigquery=args.write_bigquery,
+        workers=args.workers,
+        executor=args.executor,
+        queue_depth=args.queue_depth,
     )
 
+    if GCSPath.download_cache is not None:
+        logging.info(f"Download cache: {GCSPath.download_cache.stats()}")
+
 
 if __name__ == "__main__":
     main()
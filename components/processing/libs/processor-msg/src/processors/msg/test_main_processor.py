@@ -0,0 +1,67 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from processors.base.gcsio import GCSPath
+from processors.msg.main_processor import is_generated_output, list_source_objects
+
+
+class TestListSourceObjects(unittest.TestCase):
+
+    def test_is_generated_output(self):
+        sources = {"in/a.zip", "in/b.msg"}
+        # Metadata written next to a source
+        self.assertTrue(is_generated_output("in/a.zip.json", sources))
+        # Outputs expanded below a source, at any depth
+        self.assertTrue(is_generated_output("in/a.zip.out/x.txt", sources))
+        self.assertTrue(is_generated_output("in/a.zip.out/x.txt.json", sources))
+        self.assertTrue(
+            is_generated_output("in/b.msg.out/c.zip.out/d.out/e.txt", sources)
+        )
+        # Paths merely alike
+        self.assertFalse(is_generated_output("in/a.zip", sources))
+        self.assertFalse(is_generated_output("in/a.zip.txt", sources))
+        self.assertFalse(is_generated_output("in/a.zipx.out/x.txt", sources))
+        self.assertFalse(is_generated_output("in/c.zip.out/x.txt", sources))
+        self.assertFalse(is_generated_output("in/a.zip.out", sources))
+
+    def test_list_local(self):
+        with TemporaryDirectory() as d:
+            for path in [
+                "a.zip",
+                "a.zip.out/m.txt",
+                "a.zip.out/m.txt.json",
+                "a.zip.out/n.zip.out/deep.txt",
+                "b.txt",
+                "sub/c.pdf",
+                "sub/c.pdf.out/p.txt",
+                "d.out/x.txt",
+            ]:
+                os.makedirs(os.path.dirname(os.path.join(d, path)), exist_ok=True)
+                with open(os.path.join(d, path), "wt") as f:
+                    f.write(path)
+
+            root = GCSPath(d).path
+            listed = [
+                os.path.relpath(obj.path, root)
+                for obj in list_source_objects(GCSPath(d))
+            ]
+            # Outputs of the sources listed (e.g. by an earlier run) are
+            # skipped, other folders named .out are not
+            self.assertEqual(
+                sorted(listed), ["a.zip", "b.txt", "d.out/x.txt", "sub/c.pdf"]
+            )
@@ -38,10 +38,10 @@ def xlsx_processor(source: GCSPath, output_dir: GCSPath) -> Dict:
 
     # Load the book
     logging.info(f"Extracting spreadsheet {str(source)}")
-    with source.read_as_file() as r:
+    with source.open_random_access() as r:
         book = pyexcel.get_book(
-            file_name=r,
-            force_file_type=source.suffix[1:],
+            file_stream=r,
+            file_type=source.suffix[1:],
         )
 
         for name in book.sheet_names():